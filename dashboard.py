@@ -0,0 +1,123 @@
+"""
+The weather screen, laid out as a tree of layout nodes, and the status messages shown while fetching.
+"""
+
+import layout
+import profiler
+from layout import Column, Row, Text, Icon, Separator, Spacer, ALIGN_RIGHT, LINE_HEIGHT_THIN
+from render import DisplayController
+from utils import format_date, wrap_text, sentence_join, truncate_lines
+from weather import get_img_for_title, Weather
+
+
+class WeatherView:
+    """
+    The layout nodes showing one Weather: its images, then the temperature, titles and description beside them.
+    """
+
+    def __init__(self, show_min_max: bool = False):
+        """
+        :param show_min_max: whether to show the min/max temperatures
+        """
+        self.img_paths = []
+        self.temp = Text()
+        self.min_max = Text(align=ALIGN_RIGHT) if show_min_max else None
+        self.title = Text()
+        self.desc = Text()
+
+        temp_row = Row([self.temp, self.min_max]) if show_min_max else self.temp
+        self.details = Column([temp_row, self.title, self.desc])
+        self.node = Row([self.details], gap=4)
+
+    def update(self, weather: Weather):
+        """
+        Updates the nodes for the given weather. Only nodes whose content changed are laid out and drawn again.
+        :param weather: the weather
+        """
+        img_paths = []
+        for title in weather.titles:
+            img_path = get_img_for_title(title)
+            if img_path and img_path not in img_paths:
+                img_paths.append(img_path)
+
+        if img_paths != self.img_paths:
+            self.img_paths = img_paths
+            # the images overlap the line above by a pixel
+            self.node.set_children([Icon(img_path, margin_top=-1) for img_path in img_paths] + [self.details])
+
+        self.temp.set(f"{weather.temp.main:.1f} C")
+        if self.min_max:
+            self.min_max.set(f"L/H: {weather.temp.temp_min:.1f}-{weather.temp.temp_max:.1f} C")
+        self.title.set(sentence_join(weather.titles))
+        self.desc.set(*wrap_text(weather.description, DisplayController.MAX_TEXT_WIDTH))
+
+
+class Dashboard:
+    """
+    The layout tree for the weather screen, kept between refreshes so that only what changed is redrawn.
+    """
+
+    def __init__(self):
+        self.date = Text(line_height=LINE_HEIGHT_THIN, align=ALIGN_RIGHT)
+        self.current = WeatherView()
+        self.today_summary = Text()
+        self.daily = WeatherView(show_min_max=True)
+
+        self.root = Column([
+            Row([Text("NOW", line_height=LINE_HEIGHT_THIN), self.date]),
+            self.current.node,
+            Separator(),
+            Text("TODAY"),
+            Spacer(2),
+            self.today_summary,
+            Spacer(4),
+            self.daily.node,
+        ], padding_top=LINE_HEIGHT_THIN)
+
+    def update(self, current: Weather, daily: Weather):
+        """
+        Updates the tree for the given weather.
+        :param current: the current weather
+        :param daily: the daily weather
+        """
+        self.date.set(format_date(current.dt))
+        self.current.update(current)
+        self.today_summary.set(*truncate_lines(daily.day_summary, 3))
+        self.daily.update(daily)
+
+
+# created on first render, and reused after that
+_dashboard = None
+
+# status messages shown while fetching
+_status = Column(padding_top=LINE_HEIGHT_THIN)
+
+
+def render(display: DisplayController, current: Weather, daily: Weather):
+    """
+    Renders the given weather on the display.
+    :param display: the display controller
+    :param current: the current weather
+    :param daily: the daily weather
+    """
+    global _dashboard
+    if _dashboard is None:
+        _dashboard = Dashboard()
+
+    with profiler.span('layout'):
+        _dashboard.update(current, daily)
+        layout.show(display, _dashboard.root)
+    display.flush_display()
+
+
+def show_status(display: DisplayController, *lines: str, append: bool = False):
+    """
+    Shows a status message on the display, and starts flushing it without waiting for the refresh to finish.
+    :param display: the display controller
+    :param lines: the lines of the message
+    :param append: whether to show the message below the status message already showing, if there is one
+    """
+    messages = _status.children if append and display.shown is _status else []
+    _status.set_children(messages + [Text(*lines)])
+    layout.show(display, _status)
+    display.flush_display(wait=False)
@@ -29,7 +29,11 @@
 
 import framebuf
 import utime
-from machine import Pin, SPI
+from machine import Pin, SPI, idle
+from micropython import const
+
+import log
+import profiler
 
 WF_PARTIAL_2IN13_V3 = [
     0x0, 0x40, 0x0, 0x0, 0x0, 0x0, 0x0, 0x0, 0x0, 0x0, 0x0, 0x0,
@@ -80,6 +84,12 @@ DC_PIN = 8
 CS_PIN = 9
 BUSY_PIN = 13
 
+# longest time to wait for the panel to release BUSY
+BUSY_TIMEOUT_MS = 10_000
+
+# set to 1 and recompile to log each busy wait and init
+_DEBUG = const(0)
+
 
 class EPD_2in13_V3_Portrait(framebuf.FrameBuffer):
     def __init__(self):
@@ -190,11 +200,13 @@ class EPD_2in13_V3_Portrait(framebuf.FrameBuffer):
     '''
 
     def ReadBusy(self):
-        print('busy')
+        if _DEBUG:
+            log.debug('busy')
         self.delay_ms(10)
         while (self.digital_read(self.busy_pin) == 1):  # 0: idle, 1: busy
             self.delay_ms(10)
-        print('busy release')
+        if _DEBUG:
+            log.debug('busy release')
 
     '''
     function : Turn On Display
@@ -289,7 +301,8 @@ class EPD_2in13_V3_Portrait(framebuf.FrameBuffer):
     '''
 
     def init(self):
-        print('init')
+        if _DEBUG:
+            log.debug('init')
         self.reset()
         self.delay_ms(100)
 
@@ -434,7 +447,18 @@ class EPD_2in13_V3_Landscape(framebuf.FrameBuffer):
 
         self.buffer = bytearray(self.height * self.width // 8)
         super().__init__(self.buffer, self.height, self.width, framebuf.MONO_VLSB)
-        self.init()
+
+        # preallocated so that transfers to the panel don't allocate on every call
+        self.ram_buffer = bytearray(len(self.buffer))
+        self.byte_buffer = bytearray(1)
+
+        # BUSY falls when the panel finishes; the interrupt wakes the CPU from idle() to check it
+        self.busy_released = True
+        self.busy_pending = False
+        self.busy_started = 0
+        self.last_busy_ms = 0
+        self.busy_total_ms = 0
+        self.busy_pin.irq(handler=self._busy_released, trigger=Pin.IRQ_FALLING)
 
     def digital_write(self, pin, value):
         pin.value(value)
@@ -459,13 +483,15 @@ class EPD_2in13_V3_Landscape(framebuf.FrameBuffer):
     def send_command(self, command):
         self.digital_write(self.dc_pin, 0)
         self.digital_write(self.cs_pin, 0)
-        self.spi_writebyte([command])
+        self.byte_buffer[0] = command
+        self.spi.write(self.byte_buffer)
         self.digital_write(self.cs_pin, 1)
 
     def send_data(self, data):
         self.digital_write(self.dc_pin, 1)
         self.digital_write(self.cs_pin, 0)
-        self.spi_writebyte([data])
+        self.byte_buffer[0] = data
+        self.spi.write(self.byte_buffer)
         self.digital_write(self.cs_pin, 1)
 
     def send_data1(self, buf):
@@ -474,24 +500,77 @@ class EPD_2in13_V3_Landscape(framebuf.FrameBuffer):
         self.spi.write(bytearray(buf))
         self.digital_write(self.cs_pin, 1)
 
-    def ReadBusy(self):
-        print('busy')
-        self.delay_ms(10)
-        while (self.digital_read(self.busy_pin) == 1):  # 0: idle, 1: busy
-            self.delay_ms(10)
-        print('busy release')
+    def send_buffer(self, buf):
+        # sends the whole buffer in a single CS-asserted transfer, without copying it
+        with profiler.span('spi'):
+            self.digital_write(self.dc_pin, 1)
+            self.digital_write(self.cs_pin, 0)
+            self.spi.write(buf)
+            self.digital_write(self.cs_pin, 1)
+
+    def rotate_buffer(self, image):
+        # the MONO_VLSB framebuffer holds one 8-pixel row of bytes per `self.height` bytes;
+        # the controller expects those rows in reverse order, so each row is copied as a slice
+        rows = self.width // 8
+        src = memoryview(image)
+        dst = memoryview(self.ram_buffer)
+        for j in range(rows):
+            start = (rows - 1 - j) * self.height
+            dst[j * self.height:(j + 1) * self.height] = src[start:start + self.height]
+        return self.ram_buffer
+
+    def _busy_released(self, pin):
+        self.busy_released = True
+
+    def begin_busy(self):
+        # called once the command that makes the panel busy has been sent
+        self.busy_started = utime.ticks_ms()
+        utime.sleep_ms(1)  # allow BUSY to rise
+        self.busy_released = False
+        self.busy_pending = True
+
+    def is_busy(self):
+        # 0: idle, 1: busy; the edge may have passed between the pin rising and the flag being cleared
+        return self.busy_pending and not self.busy_released and self.digital_read(self.busy_pin) == 1
 
-    def TurnOnDisplay(self):
+    def ReadBusy(self):
+        self.begin_busy()
+        self.wait_busy()
+
+    def wait_busy(self):
+        # sleeps until the panel releases BUSY, or the timeout passes
+        if not self.busy_pending:
+            return
+
+        with profiler.span('busy'):
+            while self.is_busy():
+                if utime.ticks_diff(utime.ticks_ms(), self.busy_started) > BUSY_TIMEOUT_MS:
+                    log.warning('busy timeout after %d ms', BUSY_TIMEOUT_MS)
+                    break
+                idle()
+
+        self.busy_pending = False
+        self.last_busy_ms = utime.ticks_diff(utime.ticks_ms(), self.busy_started)
+        self.busy_total_ms += self.last_busy_ms
+        if _DEBUG:
+            log.debug('busy for %d ms', self.last_busy_ms)
+
+    def TurnOnDisplay(self, wait=True):
+        # if wait is False, returns while the panel refreshes; call wait_busy() before sending anything else
         self.send_command(0x22)  # Display Update Control
         self.send_data(0xC7)
         self.send_command(0x20)  # Activate Display Update Sequence
-        self.ReadBusy()
+        self.begin_busy()
+        if wait:
+            self.wait_busy()
 
-    def TurnOnDisplayPart(self):
+    def TurnOnDisplayPart(self, wait=True):
         self.send_command(0x22)  # Display Update Control
         self.send_data(0x0F)  # fast:0x0c, quality:0x0f, 0xcf
         self.send_command(0x20)  # Activate Display Update Sequence
-        self.ReadBusy()
+        self.begin_busy()
+        if wait:
+            self.wait_busy()
 
     def LUT(self, lut):
         self.send_command(0x32)
@@ -531,7 +610,8 @@ class EPD_2in13_V3_Landscape(framebuf.FrameBuffer):
         self.send_data((Ystart >> 8) & 0xFF)
 
     def init(self):
-        print('init')
+        if _DEBUG:
+            log.debug('init')
         self.reset()
         self.delay_ms(100)
 
@@ -569,28 +649,33 @@ class EPD_2in13_V3_Landscape(framebuf.FrameBuffer):
 
         self.TurnOnDisplay()
 
-    def display(self, image):
+    def display(self, image, wait=True):
         self.send_command(0x24)
-        for j in range(int(self.width / 8) - 1, -1, -1):
-            for i in range(0, self.height):
-                self.send_data(image[i + j * self.height])
+        self.send_buffer(self.rotate_buffer(image))
 
-        self.TurnOnDisplay()
+        self.TurnOnDisplay(wait)
 
-    def Display_Base(self, image):
+    def Display_Base(self, image, wait=True):
+        ram = self.rotate_buffer(image)
         self.send_command(0x24)
-        for j in range(int(self.width / 8) - 1, -1, -1):
-            for i in range(0, self.height):
-                self.send_data(image[i + j * self.height])
+        self.send_buffer(ram)
 
         self.send_command(0x26)
-        for j in range(int(self.width / 8) - 1, -1, -1):
-            for i in range(0, self.height):
-                self.send_data(image[i + j * self.height])
+        self.send_buffer(ram)
 
-        self.TurnOnDisplay()
+        self.TurnOnDisplay(wait)
 
-    def display_Partial(self, image):
+    def write_base(self, image):
+        # writes the image into both RAMs without refreshing, e.g. to restore the frame the
+        # panel is still showing after the controller has been reset
+        ram = self.rotate_buffer(image)
+        self.send_command(0x24)
+        self.send_buffer(ram)
+
+        self.send_command(0x26)
+        self.send_buffer(ram)
+
+    def begin_partial(self):
         self.digital_write(self.reset_pin, 0)
         self.delay_ms(1)
         self.digital_write(self.reset_pin, 1)
@@ -618,16 +703,44 @@ class EPD_2in13_V3_Landscape(framebuf.FrameBuffer):
         self.send_command(0x20)
         self.ReadBusy()
 
+    def display_Partial(self, image):
+        self.begin_partial()
+
         self.SetWindows(0, 0, self.width - 1, self.height - 1)
         self.SetCursor(0, 0)
 
         self.send_command(0x24)
-        for j in range(int(self.width / 8) - 1, -1, -1):
-            for i in range(0, self.height):
-                self.send_data(image[i + j * self.height])
+        self.send_buffer(self.rotate_buffer(image))
 
         self.TurnOnDisplayPart()
 
+    def display_Partial_windows(self, image, windows, wait=True):
+        # windows are (x0, y0, x1, y1) inclusive framebuffer coordinates, with y0/y1 on 8 pixel
+        # row boundaries; framebuffer x maps to the panel's Y axis and the rows are reversed
+        self.begin_partial()
+
+        rows = self.width // 8
+        src = memoryview(image)
+        for x0, y0, x1, y1 in windows:
+            first_row = rows - 1 - y1 // 8
+            last_row = rows - 1 - y0 // 8
+            self.SetWindows(first_row * 8, x0, last_row * 8, x1)
+            self.SetCursor(first_row, x0)
+
+            self.send_command(0x24)
+            with profiler.span('spi'):
+                self.digital_write(self.dc_pin, 1)
+                self.digital_write(self.cs_pin, 0)
+                for row in range(first_row, last_row + 1):
+                    start = (rows - 1 - row) * self.height
+                    self.spi.write(src[start + x0:start + x1 + 1])
+                self.digital_write(self.cs_pin, 1)
+
+        self.SetWindows(0, 0, self.width - 1, self.height - 1)
+        self.SetCursor(0, 0)
+
+        self.TurnOnDisplayPart(wait)
+
     def sleep(self):
         self.send_command(0x10)  # enter deep sleep
         self.send_data(0x01)
@@ -0,0 +1,134 @@
+"""
+Frames rendered by the fleet gateway (see host/gateway.py), for devices that leave parsing and layout to it.
+
+The last frame shown is kept on flash, so after a deep sleep the device can still ask for just the changes from it:
+the gateway then sends a delta against that frame (see DisplayController.apply_delta()) rather than the whole frame.
+"""
+
+import urequests as requests
+
+import os
+import utime
+
+import log
+import profiler
+from net import timings as network_timings
+from render import DisplayController, frame_hash, read_fully
+from weather import CACHE_DIR, ensure_cache_dir, header_value
+from utils import file_exists
+
+# the last frame flushed to the panel: the number of partial refreshes since the last full refresh as one byte, then
+# the framebuffer
+FRAME_FILE = f'{CACHE_DIR}/frame.bin'
+
+# response header saying how the frame is encoded
+ENCODING_HEADER = 'X-Frame-Encoding'
+ENCODING_DELTA = 'delta'
+
+
+def fetch_frame(gateway_url: str, lat: str, lon: str, display: DisplayController, has_base: bool = False) -> bool:
+    """
+    Fetches the frame for the given location from the gateway, straight into the display framebuffer, and returns
+    whether it differs from the frame on the panel. The request is conditional on the hash of the frame on the panel,
+    so an unchanged frame isn't sent at all. A delta is checked against the ETag once applied, and if the result
+    doesn't match, the whole frame is fetched instead. The panel isn't changed until the display is flushed.
+    :param gateway_url: the base URL of the gateway
+    :param lat: the latitude
+    :param lon: the longitude
+    :param display: the display controller
+    :param has_base: whether the framebuffer holds the frame on the panel, so a delta from it can be applied
+    :return: whether the frame was fetched
+    """
+    url = f"{gateway_url}/frame?lat={lat}&lon={lon}"
+    if has_base:
+        url += "&delta=1"
+    log.info("querying gateway for frame at %s,%s", lat, lon)
+
+    headers = {}
+    if display.frame_hash:
+        headers['If-None-Match'] = '"%d"' % display.frame_hash
+
+    start = utime.ticks_ms()
+    with profiler.span('http'):
+        r = requests.get(url, headers=headers)
+    network_timings['first_byte'] = utime.ticks_diff(utime.ticks_ms(), start)
+
+    matches = True
+    try:
+        if r.status_code == 304:
+            log.info("frame not modified")
+            return False
+        if r.status_code != 200:
+            raise OSError(f"gateway returned status {r.status_code}")
+
+        with profiler.span('read_frame'):
+            if has_base and header_value(r.headers, ENCODING_HEADER) == ENCODING_DELTA:
+                delta = r.content
+                log.info("applying %d byte delta", len(delta))
+                try:
+                    display.apply_delta(delta)
+                    matches = header_value(r.headers, 'ETag') == '"%d"' % frame_hash(display.epd.buffer)
+                except ValueError as e:
+                    log.warning("delta is malformed: %s", e)
+                    matches = False
+            else:
+                display.read_frame(r.raw)
+    finally:
+        r.close()
+
+    if not matches:
+        # the gateway made the delta from a different frame than the one in the framebuffer; the frame on the panel is
+        # put back first, so nothing is left of the corrupt one if the refetch fails
+        log.warning("frame doesn't match its ETag after applying the delta; fetching it whole")
+        display.epd.buffer[:] = display.last_frame
+        if not fetch_frame(gateway_url, lat, lon, display):
+            raise OSError("gateway sent a delta, then reported the frame not modified")
+    return True
+
+
+def load_frame(display: DisplayController) -> bool:
+    """
+    Loads the last frame flushed to the panel into the framebuffer, and returns whether it is the frame the panel is
+    showing. If it is, it becomes the base for the next partial refresh.
+    :param display: the display controller
+    """
+    if not display.frame_hash or not file_exists(FRAME_FILE):
+        return False
+
+    buffer = memoryview(display.epd.buffer)
+    header = bytearray(1)
+    with open(FRAME_FILE, 'rb') as f:
+        try:
+            read_fully(f, header)
+            read_fully(f, buffer)
+        except OSError:
+            log.warning("frame file is truncated")
+            return False
+
+    if frame_hash(buffer) != display.frame_hash:
+        log.info("saved frame is not the one on the panel")
+        return False
+
+    display.last_frame = bytearray(buffer)
+    display.updates_since_full = header[0]
+    return True
+
+
+def save_frame(display: DisplayController):
+    """
+    Saves the frame last flushed to the panel, to apply the next delta to. The file is written alongside the existing
+    one then renamed over it, so an interrupted write never leaves a partial frame.
+    :param display: the display controller
+    """
+    ensure_cache_dir()
+    tmp_file = FRAME_FILE + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        f.write(bytes([min(display.updates_since_full, 255)]))
+        f.write(display.last_frame)
+
+    try:
+        os.rename(tmp_file, FRAME_FILE)
+    except OSError:
+        # some filesystems won't rename over an existing file
+        os.remove(FRAME_FILE)
+        os.rename(tmp_file, FRAME_FILE)
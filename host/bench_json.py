@@ -0,0 +1,56 @@
+"""
+Compares the peak memory and time of parsing a One Call API response with json.loads() against the streaming
+parser used by fetch_weather().
+
+Usage:
+    python3 host/bench_json.py [WEATHER_JSON]
+"""
+
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from sim import ROOT_DIR
+
+import jsonstream
+from weather import WEATHER_RESPONSE_SPEC, parse_weather
+
+
+def measure(label: str, parse) -> dict:
+    """
+    Runs the given parse function and reports its peak allocation and elapsed time.
+    :param label: the label to report
+    :param parse: a function returning the parsed response
+    :return: the parsed response
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    resp = parse()
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{label}: peak {peak} bytes, {elapsed_ms:.2f} ms", file=sys.stderr)
+    return resp
+
+
+def main(args: list[str]):
+    path = args[0] if args else os.path.join(ROOT_DIR, 'examples', 'weather.json')
+    with open(path, 'rb') as f:
+        body = f.read()
+    print(f"response body: {len(body)} bytes", file=sys.stderr)
+
+    full = measure('json.loads', lambda: json.loads(body))
+    streamed = measure('jsonstream', lambda: jsonstream.parse(io.BytesIO(body), WEATHER_RESPONSE_SPEC))
+
+    full_weather = [w.to_dict() for w in parse_weather(full)]
+    streamed_weather = [w.to_dict() for w in parse_weather(streamed)]
+    if full_weather != streamed_weather:
+        raise SystemExit('streamed response does not match the full response')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,173 @@
+"""
+Stand-in for ampy's Pyboard, for exercising the deploy scripts without a device attached.
+
+Raw REPL commands are run in this process, with a directory on the host standing in for the device filesystem:
+`open()` and the `os` functions the scripts use are confined to that directory, and errors are reported the way
+MicroPython reports them, so callers that inspect the traceback text behave as they would against a real board.
+An optional delay per command simulates the serial round trip.
+"""
+
+import builtins
+import contextlib
+import errno
+import io
+import os as _os
+import posixpath
+import threading
+import time
+import traceback
+
+from ampy.pyboard import PyboardError
+
+# module names that commands import, mapped to the host modules standing in for them; others, such as utime, are
+# the stand-ins in this directory
+_MODULE_ALIASES = {
+    'ubinascii': 'binascii',
+    'uhashlib': 'hashlib',
+}
+
+
+class _FakeSerial:
+    def __init__(self):
+        self.written = bytearray()
+
+    def write(self, data: bytes):
+        self.written.extend(data)
+
+    def close(self):
+        pass
+
+
+class _DeviceOs:
+    """
+    The subset of MicroPython's os module used by the deploy scripts, confined to the device directory.
+    """
+    sep = '/'
+
+    def __init__(self, root: str):
+        self._root = root
+        self._cwd = '/'
+
+    def _path(self, path: str = '') -> str:
+        device_path = posixpath.normpath(posixpath.join(self._cwd, path))
+        return _os.path.join(self._root, device_path.lstrip('/'))
+
+    def getcwd(self) -> str:
+        return self._cwd
+
+    def chdir(self, path: str):
+        device_path = posixpath.normpath(posixpath.join(self._cwd, path))
+        if not _os.path.isdir(self._path(device_path)):
+            raise OSError(errno.ENOENT, 'ENOENT')
+        self._cwd = device_path
+
+    def listdir(self, path: str = '') -> list:
+        return sorted(_os.listdir(self._path(path)))
+
+    def ilistdir(self, path: str = ''):
+        for name in self.listdir(path):
+            full_path = _os.path.join(self._path(path), name)
+            kind = 0x4000 if _os.path.isdir(full_path) else 0x8000
+            yield name, kind, 0, _os.path.getsize(full_path) if kind == 0x8000 else 0
+
+    def stat(self, path: str) -> tuple:
+        return tuple(_os.stat(self._path(path)))
+
+    def mkdir(self, path: str):
+        _os.mkdir(self._path(path))
+
+    def rmdir(self, path: str):
+        _os.rmdir(self._path(path))
+
+    def remove(self, path: str):
+        host_path = self._path(path)
+        if _os.path.isdir(host_path):
+            # like littlefs, an empty directory can be removed as a file
+            if _os.listdir(host_path):
+                raise OSError(errno.EACCES, 'EACCES')
+            _os.rmdir(host_path)
+        else:
+            _os.remove(host_path)
+
+    def rename(self, old: str, new: str):
+        _os.rename(self._path(old), self._path(new))
+
+
+class FakePyboard:
+    """
+    A board whose filesystem is a directory on the host.
+    """
+
+    def __init__(self, root: str, delay: float = 0.0):
+        """
+        :param root: the directory standing in for the device filesystem; created if it doesn't exist
+        :param delay: seconds to wait per command, to simulate the serial round trip
+        """
+        _os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.delay = delay
+        self.serial = _FakeSerial()
+        self.commands = 0
+        self._globals = None
+        self._lock = threading.Lock()
+
+    def enter_raw_repl(self):
+        # entering the raw REPL soft resets the board, so nothing defined by earlier commands survives
+        self._globals = self._fresh_globals()
+
+    def exit_raw_repl(self):
+        pass
+
+    def close(self):
+        pass
+
+    def exec_(self, command, stream_output: bool = False) -> bytes:
+        if isinstance(command, bytes):
+            command = command.decode('utf-8')
+        if self._globals is None:
+            self.enter_raw_repl()
+
+        with self._lock:
+            self.commands += 1
+        if self.delay:
+            time.sleep(self.delay)
+
+        output = io.StringIO()
+        try:
+            # stdout is process-wide, so commands from concurrent boards are run one at a time
+            with _exec_lock, contextlib.redirect_stdout(output):
+                exec(command, self._globals)
+        except Exception as e:
+            raise PyboardError('exception', output.getvalue().encode(), _micropython_traceback(e).encode())
+
+        return output.getvalue().encode()
+
+    def _fresh_globals(self) -> dict:
+        device_os = _DeviceOs(self.root)
+
+        def device_open(path, mode='r', *args, **kwargs):
+            return builtins.open(device_os._path(path), mode, *args, **kwargs)
+
+        def device_import(name, *args, **kwargs):
+            if name in ('os', 'uos'):
+                return device_os
+            return builtins.__import__(_MODULE_ALIASES.get(name, name), *args, **kwargs)
+
+        device_builtins = dict(vars(builtins))
+        device_builtins['open'] = device_open
+        device_builtins['__import__'] = device_import
+        return {'__builtins__': device_builtins, '__name__': '__main__'}
+
+
+_exec_lock = threading.Lock()
+
+
+def _micropython_traceback(e: Exception) -> str:
+    """
+    Formats an exception the way MicroPython does, including its errno names for OSError.
+    """
+    if isinstance(e, OSError) and e.errno is not None:
+        message = f"OSError: [Errno {e.errno}] {errno.errorcode.get(e.errno, '')}"
+    else:
+        message = ''.join(traceback.format_exception_only(type(e), e)).strip()
+    return f"Traceback (most recent call last):\n{message}\n"
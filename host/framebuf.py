@@ -0,0 +1,210 @@
+"""
+Pure-Python subset of MicroPython's framebuf module, for running the display code on a host machine.
+"""
+
+MONO_VLSB = 0
+RGB565 = 1
+GS4_HMSB = 2
+MONO_HLSB = 3
+MONO_HMSB = 4
+
+# 8x8 font for printable ASCII in the style of the font built into MicroPython's framebuf;
+# each glyph is 8 columns of 8 pixels, least significant bit at the top
+FONT_8X8 = (
+    b'\x00\x00\x00\x00\x00\x00\x00\x00'  # 32 space
+    b'\x00\x00\x00\x4f\x4f\x00\x00\x00'  # 33 !
+    b'\x00\x07\x07\x00\x00\x07\x07\x00'  # 34 "
+    b'\x14\x7f\x7f\x14\x14\x7f\x7f\x14'  # 35 #
+    b'\x00\x24\x2e\x6b\x6b\x3a\x12\x00'  # 36 $
+    b'\x00\x63\x33\x18\x0c\x66\x63\x00'  # 37 %
+    b'\x00\x32\x7f\x4d\x4d\x77\x72\x50'  # 38 &
+    b'\x00\x00\x00\x04\x06\x03\x01\x00'  # 39 '
+    b'\x00\x00\x1c\x3e\x63\x41\x00\x00'  # 40 (
+    b'\x00\x00\x41\x63\x3e\x1c\x00\x00'  # 41 )
+    b'\x08\x2a\x3e\x1c\x1c\x3e\x2a\x08'  # 42 *
+    b'\x00\x08\x08\x3e\x3e\x08\x08\x00'  # 43 +
+    b'\x00\x00\x80\xe0\x60\x00\x00\x00'  # 44 ,
+    b'\x00\x08\x08\x08\x08\x08\x08\x00'  # 45 -
+    b'\x00\x00\x00\x60\x60\x00\x00\x00'  # 46 .
+    b'\x00\x40\x60\x30\x18\x0c\x06\x02'  # 47 /
+    b'\x00\x3e\x7f\x49\x45\x7f\x3e\x00'  # 48 0
+    b'\x00\x40\x44\x7f\x7f\x40\x40\x00'  # 49 1
+    b'\x00\x62\x73\x51\x49\x4f\x46\x00'  # 50 2
+    b'\x00\x22\x63\x49\x49\x7f\x36\x00'  # 51 3
+    b'\x00\x18\x18\x14\x16\x7f\x7f\x10'  # 52 4
+    b'\x00\x27\x67\x45\x45\x7d\x39\x00'  # 53 5
+    b'\x00\x3e\x7f\x49\x49\x7b\x32\x00'  # 54 6
+    b'\x00\x03\x03\x79\x7d\x07\x03\x00'  # 55 7
+    b'\x00\x36\x7f\x49\x49\x7f\x36\x00'  # 56 8
+    b'\x00\x26\x6f\x49\x49\x7f\x3e\x00'  # 57 9
+    b'\x00\x00\x00\x24\x24\x00\x00\x00'  # 58 :
+    b'\x00\x00\x80\xe4\x64\x00\x00\x00'  # 59 ;
+    b'\x00\x08\x1c\x36\x63\x41\x41\x00'  # 60 <
+    b'\x00\x14\x14\x14\x14\x14\x14\x00'  # 61 =
+    b'\x00\x41\x41\x63\x36\x1c\x08\x00'  # 62 >
+    b'\x00\x02\x03\x51\x59\x0f\x06\x00'  # 63 ?
+    b'\x00\x3e\x7f\x41\x4d\x4f\x2e\x00'  # 64 @
+    b'\x00\x7c\x7e\x0b\x0b\x7e\x7c\x00'  # 65 A
+    b'\x00\x7f\x7f\x49\x49\x7f\x36\x00'  # 66 B
+    b'\x00\x3e\x7f\x41\x41\x63\x22\x00'  # 67 C
+    b'\x00\x7f\x7f\x41\x63\x3e\x1c\x00'  # 68 D
+    b'\x00\x7f\x7f\x49\x49\x41\x41\x00'  # 69 E
+    b'\x00\x7f\x7f\x09\x09\x01\x01\x00'  # 70 F
+    b'\x00\x3e\x7f\x41\x49\x7b\x3a\x00'  # 71 G
+    b'\x00\x7f\x7f\x08\x08\x7f\x7f\x00'  # 72 H
+    b'\x00\x00\x41\x7f\x7f\x41\x00\x00'  # 73 I
+    b'\x00\x20\x60\x41\x7f\x3f\x01\x00'  # 74 J
+    b'\x00\x7f\x7f\x1c\x36\x63\x41\x00'  # 75 K
+    b'\x00\x7f\x7f\x40\x40\x40\x40\x00'  # 76 L
+    b'\x00\x7f\x7f\x06\x0c\x06\x7f\x7f'  # 77 M
+    b'\x00\x7f\x7f\x0e\x1c\x7f\x7f\x00'  # 78 N
+    b'\x00\x3e\x7f\x41\x41\x7f\x3e\x00'  # 79 O
+    b'\x00\x7f\x7f\x09\x09\x0f\x06\x00'  # 80 P
+    b'\x00\x1e\x3f\x21\x61\x7f\x5e\x00'  # 81 Q
+    b'\x00\x7f\x7f\x19\x39\x6f\x46\x00'  # 82 R
+    b'\x00\x26\x6f\x49\x49\x7b\x32\x00'  # 83 S
+    b'\x00\x01\x01\x7f\x7f\x01\x01\x00'  # 84 T
+    b'\x00\x3f\x7f\x40\x40\x7f\x3f\x00'  # 85 U
+    b'\x00\x1f\x3f\x60\x60\x3f\x1f\x00'  # 86 V
+    b'\x00\x7f\x7f\x30\x18\x30\x7f\x7f'  # 87 W
+    b'\x00\x63\x77\x1c\x1c\x77\x63\x00'  # 88 X
+    b'\x00\x07\x0f\x78\x78\x0f\x07\x00'  # 89 Y
+    b'\x00\x61\x71\x59\x4d\x47\x43\x00'  # 90 Z
+    b'\x00\x00\x7f\x7f\x41\x41\x00\x00'  # 91 [
+    b'\x00\x02\x06\x0c\x18\x30\x60\x40'  # 92 \\
+    b'\x00\x00\x41\x41\x7f\x7f\x00\x00'  # 93 ]
+    b'\x00\x08\x0c\x06\x06\x0c\x08\x00'  # 94 ^
+    b'\xc0\xc0\xc0\xc0\xc0\xc0\xc0\xc0'  # 95 _
+    b'\x00\x00\x01\x03\x06\x04\x00\x00'  # 96 `
+    b'\x00\x20\x74\x54\x54\x7c\x78\x00'  # 97 a
+    b'\x00\x7f\x7f\x44\x44\x7c\x38\x00'  # 98 b
+    b'\x00\x38\x7c\x44\x44\x6c\x28\x00'  # 99 c
+    b'\x00\x38\x7c\x44\x44\x7f\x7f\x00'  # 100 d
+    b'\x00\x38\x7c\x54\x54\x5c\x58\x00'  # 101 e
+    b'\x00\x08\x7e\x7f\x09\x03\x02\x00'  # 102 f
+    b'\x00\x98\xbc\xa4\xa4\xfc\x7c\x00'  # 103 g
+    b'\x00\x7f\x7f\x04\x04\x7c\x78\x00'  # 104 h
+    b'\x00\x00\x00\x7d\x7d\x00\x00\x00'  # 105 i
+    b'\x00\x40\xc0\x80\x80\xfd\x7d\x00'  # 106 j
+    b'\x00\x7f\x7f\x30\x38\x6c\x44\x00'  # 107 k
+    b'\x00\x00\x41\x7f\x7f\x40\x00\x00'  # 108 l
+    b'\x00\x7c\x7c\x0c\x18\x0c\x7c\x78'  # 109 m
+    b'\x00\x7c\x7c\x04\x04\x7c\x78\x00'  # 110 n
+    b'\x00\x38\x7c\x44\x44\x7c\x38\x00'  # 111 o
+    b'\x00\xfc\xfc\x24\x24\x3c\x18\x00'  # 112 p
+    b'\x00\x18\x3c\x24\x24\xfc\xfc\x00'  # 113 q
+    b'\x00\x7c\x7c\x04\x04\x0c\x08\x00'  # 114 r
+    b'\x00\x48\x5c\x54\x54\x74\x24\x00'  # 115 s
+    b'\x00\x04\x04\x3e\x7e\x44\x44\x00'  # 116 t
+    b'\x00\x3c\x7c\x40\x40\x7c\x7c\x00'  # 117 u
+    b'\x00\x1c\x3c\x60\x60\x3c\x1c\x00'  # 118 v
+    b'\x00\x1c\x7c\x70\x38\x70\x7c\x1c'  # 119 w
+    b'\x00\x44\x6c\x38\x38\x6c\x44\x00'  # 120 x
+    b'\x00\x9c\xbc\xa0\xe0\x7c\x3c\x00'  # 121 y
+    b'\x00\x44\x64\x74\x5c\x4c\x44\x00'  # 122 z
+    b'\x00\x08\x08\x3e\x77\x41\x41\x00'  # 123 {
+    b'\x00\x00\x00\xff\xff\x00\x00\x00'  # 124 |
+    b'\x00\x41\x41\x77\x3e\x08\x08\x00'  # 125 }
+    b'\x00\x02\x03\x01\x03\x02\x03\x01'  # 126 ~
+    b'\x00\xaa\x55\xaa\x55\xaa\x55\xaa'  # 127 DEL
+)
+
+
+class FrameBuffer:
+    """
+    Monochrome framebuffer supporting the MONO_VLSB, MONO_HLSB and MONO_HMSB formats.
+    """
+
+    def __init__(self, buffer, width: int, height: int, buf_format: int, stride: int = None):
+        if buf_format not in (MONO_VLSB, MONO_HLSB, MONO_HMSB):
+            raise ValueError(f"unsupported format {buf_format}")
+
+        self._buf = buffer
+        self._width = width
+        self._height = height
+        self._format = buf_format
+        self._stride = width if stride is None else stride
+
+    def _index(self, x: int, y: int) -> tuple[int, int]:
+        if self._format == MONO_VLSB:
+            return (y >> 3) * self._stride + x, y & 7
+        offset = (y * ((self._stride + 7) & ~7) + x) >> 3
+        if self._format == MONO_HLSB:
+            return offset, 7 - (x & 7)
+        return offset, x & 7
+
+    def pixel(self, x: int, y: int, c: int = None):
+        if not (0 <= x < self._width and 0 <= y < self._height):
+            return None
+        offset, bit = self._index(x, y)
+        if c is None:
+            return (self._buf[offset] >> bit) & 1
+        if c & 1:
+            self._buf[offset] |= 1 << bit
+        else:
+            self._buf[offset] &= ~(1 << bit) & 0xff
+
+    def fill(self, c: int):
+        value = 0xff if c & 1 else 0x00
+        for i in range(len(self._buf)):
+            self._buf[i] = value
+
+    def fill_rect(self, x: int, y: int, w: int, h: int, c: int):
+        for yy in range(max(y, 0), min(y + h, self._height)):
+            for xx in range(max(x, 0), min(x + w, self._width)):
+                self.pixel(xx, yy, c)
+
+    def hline(self, x: int, y: int, w: int, c: int):
+        self.fill_rect(x, y, w, 1, c)
+
+    def vline(self, x: int, y: int, h: int, c: int):
+        self.fill_rect(x, y, 1, h, c)
+
+    def rect(self, x: int, y: int, w: int, h: int, c: int, f: bool = False):
+        if f:
+            self.fill_rect(x, y, w, h, c)
+            return
+        self.hline(x, y, w, c)
+        self.hline(x, y + h - 1, w, c)
+        self.vline(x, y, h, c)
+        self.vline(x + w - 1, y, h, c)
+
+    def line(self, x1: int, y1: int, x2: int, y2: int, c: int):
+        dx = abs(x2 - x1)
+        dy = -abs(y2 - y1)
+        sx = 1 if x1 < x2 else -1
+        sy = 1 if y1 < y2 else -1
+        err = dx + dy
+        while True:
+            self.pixel(x1, y1, c)
+            if x1 == x2 and y1 == y2:
+                break
+            e2 = 2 * err
+            if e2 >= dy:
+                err += dy
+                x1 += sx
+            if e2 <= dx:
+                err += dx
+                y1 += sy
+
+    def text(self, s: str, x: int, y: int, c: int = 1):
+        for ch in s:
+            code = ord(ch)
+            if code < 32 or code > 127:
+                code = 127
+            offset = (code - 32) * 8
+            for col in range(8):
+                column = FONT_8X8[offset + col]
+                for row in range(8):
+                    if column & (1 << row):
+                        self.pixel(x + col, y + row, c)
+            x += 8
+
+    def blit(self, fb: "FrameBuffer", x: int, y: int, key: int = -1, palette=None):
+        for yy in range(fb._height):
+            for xx in range(fb._width):
+                c = fb.pixel(xx, yy)
+                if palette is not None:
+                    c = palette.pixel(c, 0)
+                if c != key:
+                    self.pixel(x + xx, y + yy, c)
@@ -0,0 +1,409 @@
+"""
+Weather gateway for a fleet of dashboards, so devices near each other share one upstream request.
+
+Devices set weather_gateway in config.txt and ask the gateway for their location's weather instead of calling
+OpenWeatherMap. The gateway snaps each location to a grid cell and keeps the weather for each cell in an LRU cache for
+a fixed time. Concurrent requests for a cell that isn't cached wait for a single upstream call. The weather is fetched
+with the device's own fetch_weather(), and sent as the binary records the device keeps in its cache file, tagged with
+its dt, so a device that already has it gets a 304.
+
+Devices that also set gateway_frames fetch the finished frame instead. The gateway renders the dashboard with the
+device's own layout code on a simulated display, and sends the framebuffer in the order the panel's RAM holds it,
+tagged with the frame hash the device keeps, so the device only has to read it into its framebuffer and flush it.
+A device that still holds the frame on its panel asks for a delta, and names that frame's hash in If-None-Match; if
+the gateway rendered that frame recently, it sends just the bytes that changed, XORed with the old ones, in spans that
+each lie within one row of bytes (see encode_delta()).
+
+Endpoints:
+    GET /weather?lat=LAT&lon=LON    the weather for the cell containing the location
+    GET /frame?lat=LAT&lon=LON      the rendered frame for the cell containing the location
+    GET /frame?lat=LAT&lon=LON&delta=1
+                                    as above, but as a delta from the frame named in If-None-Match, if known
+    GET /stats                      request counts, cache hit ratio and upstream QPS, as JSON
+
+With --mock, the gateway starts a local stand-in for the One Call API that serves a saved response, and uses it as
+the upstream, so it can be tried without an API key.
+
+Usage:
+    python3 host/gateway.py [--port N] [--key KEY] [--grid DEGREES] [--ttl SECS] [--mock [WEATHER_JSON]]
+"""
+
+import argparse
+import json
+import os
+import struct
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from sim import SimulatedEPD, ROOT_DIR
+
+import dashboard
+from frames import ENCODING_DELTA, ENCODING_HEADER
+from render import DisplayController, frame_hash
+from weather import API_BASE, fetch_weather, pack_weather_pair, unpack_weather
+
+# the window over which the recent upstream QPS is measured
+QPS_WINDOW_SECS = 60
+
+# equal bytes between two changes that are sent rather than starting a new span, as a span header is four bytes
+MAX_DELTA_GAP = 4
+
+
+class Flight:
+    """
+    An upstream call in progress, which requests for the same cell wait on.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.entry = None
+        self.error = None
+
+
+class WeatherCache:
+    """
+    The weather by grid cell, with a time to live, an LRU size limit and single-flight upstream calls.
+    """
+
+    def __init__(self, fetch, ttl_secs: float, max_cells: int):
+        """
+        :param fetch: called with (lat, lon) to fetch the weather for a cell; returns (etag, body)
+        :param ttl_secs: how long the weather for a cell is kept
+        :param max_cells: the most cells kept; the least recently used is dropped to make room
+        """
+        self.fetch = fetch
+        self.ttl_secs = ttl_secs
+        self.max_cells = max_cells
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.flights = {}
+        self.started = time.monotonic()
+        self.upstream_times = deque()
+        self.stats = {'requests': 0, 'hits': 0, 'coalesced': 0, 'upstream': 0, 'errors': 0, 'evictions': 0}
+
+    def get(self, cell: tuple[str, str]) -> tuple[str, bytes]:
+        """
+        Returns the (etag, body) for the given cell, fetching it if it isn't cached. If another request is already
+        fetching the cell, waits for that instead.
+        :param cell: the (lat, lon) of the cell
+        """
+        with self.lock:
+            self.stats['requests'] += 1
+            entry = self.entries.get(cell)
+            if entry and entry[0] > time.monotonic():
+                self.entries.move_to_end(cell)
+                self.stats['hits'] += 1
+                return entry[1], entry[2]
+
+            flight = self.flights.get(cell)
+            leader = flight is None
+            if leader:
+                flight = self.flights[cell] = Flight()
+            else:
+                self.stats['coalesced'] += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error:
+                raise flight.error
+            return flight.entry
+
+        try:
+            flight.entry = self.fetch(*cell)
+        except Exception as e:
+            flight.error = e
+        finally:
+            with self.lock:
+                del self.flights[cell]
+                self.stats['upstream'] += 1
+                self.upstream_times.append(time.monotonic())
+                if flight.error:
+                    self.stats['errors'] += 1
+                else:
+                    self.put(cell, flight.entry)
+            flight.done.set()
+
+        if flight.error:
+            raise flight.error
+        return flight.entry
+
+    def put(self, cell: tuple[str, str], entry: tuple[str, bytes]):
+        # called with the lock held
+        self.entries[cell] = (time.monotonic() + self.ttl_secs, entry[0], entry[1])
+        self.entries.move_to_end(cell)
+        while len(self.entries) > self.max_cells:
+            self.entries.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def report(self) -> dict:
+        """
+        Returns the request counts, with the cache hit ratio and the upstream QPS since starting and recently.
+        """
+        with self.lock:
+            now = time.monotonic()
+            while self.upstream_times and self.upstream_times[0] < now - QPS_WINDOW_SECS:
+                self.upstream_times.popleft()
+            uptime = now - self.started
+            requests = self.stats['requests']
+            return dict(
+                self.stats,
+                cells=len(self.entries),
+                hit_ratio=round(self.stats['hits'] / requests, 3) if requests else None,
+                upstream_qps=round(self.stats['upstream'] / uptime, 3) if uptime else None,
+                recent_upstream_qps=round(len(self.upstream_times) / min(uptime, QPS_WINDOW_SECS), 3),
+                uptime_secs=round(uptime, 1),
+            )
+
+
+class FrameRenderer:
+    """
+    Renders the dashboard for the weather sent to devices, keeping the most recent frames.
+    """
+
+    def __init__(self, max_frames: int):
+        """
+        :param max_frames: the most frames kept; the least recently used is dropped to make room
+        """
+        self.max_frames = max_frames
+        # the dashboard keeps its layout tree in a module global, so frames are rendered one at a time
+        self.lock = threading.Lock()
+        self.frames = OrderedDict()
+        # the framebuffers of recent frames by ETag, which deltas are made from; kept after the weather they were
+        # rendered for has moved on, as that is when devices ask for a delta from them
+        self.buffers = OrderedDict()
+        self.rendered = 0
+        self.row_bytes = 0
+
+    def get(self, body: bytes) -> tuple[str, bytes]:
+        """
+        Returns the ETag and the frame in panel RAM order for the given weather records.
+        :param body: the weather records, as sent to devices
+        """
+        with self.lock:
+            frame = self.frames.get(body)
+            if frame is None:
+                frame = self.frames[body] = self.render(body)
+                while len(self.frames) > self.max_frames:
+                    self.frames.popitem(last=False)
+            self.frames.move_to_end(body)
+            return frame
+
+    def get_delta(self, base_etag: str, etag: str) -> bytes:
+        """
+        Returns the delta from one recent frame to another, or None if the base frame isn't known.
+        :param base_etag: the ETag of the frame the device holds
+        :param etag: the ETag of the frame to send, as returned by get()
+        """
+        with self.lock:
+            old = self.buffers.get(base_etag)
+            new = self.buffers.get(etag)
+        if old is None or new is None:
+            return None
+        return encode_delta(old, new, self.row_bytes)
+
+    def render(self, body: bytes) -> tuple[str, bytes]:
+        # called with the lock held
+        current, offset = unpack_weather(body, 0)
+        daily, _ = unpack_weather(body, offset)
+
+        epd = SimulatedEPD()
+        display = DisplayController(epd)
+        dashboard.render(display, current, daily)
+        self.rendered += 1
+        self.row_bytes = display.screen_width
+
+        # tagged with the hash the device keeps of the frame on its panel
+        etag = f'"{frame_hash(epd.buffer)}"'
+        self.buffers[etag] = bytes(epd.buffer)
+        self.buffers.move_to_end(etag)
+        while len(self.buffers) > self.max_frames * 2:
+            self.buffers.popitem(last=False)
+        return etag, bytes(epd.rotate_buffer(epd.buffer))
+
+
+def encode_delta(old: bytes, new: bytes, row_bytes: int, max_gap: int = MAX_DELTA_GAP) -> bytes:
+    """
+    Returns the delta from one framebuffer to another, as applied by DisplayController.apply_delta(): a sequence of
+    spans, each a little-endian uint16 offset and uint16 length, followed by the new bytes XORed with the old ones.
+    Spans are split at the end of each row of bytes, so the device can mark just the changed part of each row.
+    :param old: the framebuffer the device holds
+    :param new: the framebuffer to send
+    :param row_bytes: the bytes in a row of the framebuffer
+    :param max_gap: the most equal bytes sent within a span rather than starting a new one
+    """
+    delta = bytearray()
+    for row in range(0, len(new), row_bytes):
+        changed = [i for i in range(row, row + row_bytes) if old[i] != new[i]]
+        if not changed:
+            continue
+
+        start = end = changed[0]
+        for i in changed[1:] + [None]:
+            if i is not None and i - end <= max_gap + 1:
+                end = i
+                continue
+            delta += struct.pack('<HH', start, end - start + 1)
+            delta += bytes(a ^ b for a, b in zip(old[start:end + 1], new[start:end + 1]))
+            if i is not None:
+                start = end = i
+    return bytes(delta)
+
+
+def to_cell(lat: float, lon: float, grid: float) -> tuple[str, str]:
+    """
+    Returns the centre of the grid cell holding the given location, formatted for the upstream request.
+    :param lat: the latitude
+    :param lon: the longitude
+    :param grid: the size of a cell in degrees
+    """
+    decimals = len(f"{grid:f}".rstrip("0").split(".")[1])
+    return f"{round(lat / grid) * grid:.{decimals}f}", f"{round(lon / grid) * grid:.{decimals}f}"
+
+
+def make_fetch(key: str, api_base: str):
+    """
+    Returns a function fetching the weather for a cell from the upstream API, as the ETag and body sent to devices.
+    """
+
+    def fetch(lat: str, lon: str) -> tuple[str, bytes]:
+        current, daily = fetch_weather(lat, lon, key, api_base=api_base, remember_validators=False)
+        return f'"{current.dt}"', pack_weather_pair(current, daily)
+
+    return fetch
+
+
+def make_handler(cache: WeatherCache, renderer: FrameRenderer, grid: float):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == '/stats':
+                report = dict(cache.report(), frames_rendered=renderer.rendered)
+                self.send_body(200, json.dumps(report).encode(), 'application/json')
+            elif url.path in ('/weather', '/frame'):
+                self.send_weather(parse_qs(url.query), url.path == '/frame')
+            else:
+                self.send_body(404, b'not found\n', 'text/plain')
+
+        def send_weather(self, query: dict, rendered: bool):
+            try:
+                cell = to_cell(float(query['lat'][0]), float(query['lon'][0]), grid)
+            except (KeyError, ValueError):
+                self.send_body(400, b'lat and lon are required\n', 'text/plain')
+                return
+
+            try:
+                etag, body = cache.get(cell)
+            except Exception as e:
+                self.send_body(502, f"upstream failed: {e}\n".encode(), 'text/plain')
+                return
+
+            if rendered:
+                etag, body = renderer.get(body)
+
+            base_etag = self.headers.get('If-None-Match')
+            if base_etag == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.end_headers()
+                return
+
+            encoding = None
+            if rendered and base_etag and query.get('delta') == ['1']:
+                delta = renderer.get_delta(base_etag, etag)
+                if delta is not None and len(delta) < len(body):
+                    body, encoding = delta, ENCODING_DELTA
+            self.send_body(200, body, 'application/octet-stream', etag, encoding)
+
+        def send_body(self, status: int, body: bytes, content_type: str, etag: str = None, encoding: str = None):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            if etag:
+                self.send_header('ETag', etag)
+            if encoding:
+                self.send_header(ENCODING_HEADER, encoding)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+class MockUpstream:
+    """
+    A local stand-in for the One Call API, serving a saved response after a delay and counting the requests.
+    """
+
+    def __init__(self, weather_json: str, latency_secs: float):
+        with open(weather_json, 'rb') as f:
+            self.body = f.read()
+        self.latency_secs = latency_secs
+        self.requests = 0
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.make_handler())
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def make_handler(self):
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                upstream.requests += 1
+                time.sleep(upstream.latency_secs)
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(upstream.body)))
+                self.end_headers()
+                self.wfile.write(upstream.body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def main(args: list[str]):
+    parser = argparse.ArgumentParser(description='Serves weather to a fleet of dashboards from a shared cache.')
+    parser.add_argument('--host', default='0.0.0.0', help='address to listen on')
+    parser.add_argument('--port', type=int, default=8080, help='port to listen on')
+    parser.add_argument('--key', default=os.environ.get('OPENWEATHERMAP_KEY', ''),
+                        help='the OpenWeatherMap API key; defaults to $OPENWEATHERMAP_KEY')
+    parser.add_argument('--grid', type=float, default=0.1, help='size of a grid cell in degrees')
+    parser.add_argument('--ttl', type=float, default=600, help='seconds to keep the weather for a cell')
+    parser.add_argument('--max-cells', type=int, default=1024, help='the most cells to keep')
+    parser.add_argument('--upstream', default=API_BASE, help='base URL of the One Call API')
+    parser.add_argument('--mock', nargs='?', const=os.path.join(ROOT_DIR, 'examples', 'weather.json'),
+                        metavar='WEATHER_JSON', help='serve this response from a local mock upstream')
+    parser.add_argument('--mock-latency', type=float, default=0.2, help='seconds the mock upstream takes to respond')
+    opts = parser.parse_args(args)
+
+    api_base = opts.upstream
+    if opts.mock:
+        mock = MockUpstream(opts.mock, opts.mock_latency)
+        api_base = mock.url
+        print(f"mock upstream on {api_base}", file=sys.stderr)
+    elif not opts.key:
+        parser.error('an API key is needed, unless using --mock')
+
+    cache = WeatherCache(make_fetch(opts.key, api_base), opts.ttl, opts.max_cells)
+    renderer = FrameRenderer(opts.max_cells)
+    server = ThreadingHTTPServer((opts.host, opts.port), make_handler(cache, renderer, opts.grid))
+    print(f"gateway listening on {opts.host}:{server.server_address[1]}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(json.dumps(cache.report()), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,74 @@
+"""
+Host stand-in for MicroPython's machine module. Pins hold their last value, and the SPI bus records every
+transfer so that traffic to the display can be inspected.
+"""
+
+import sys
+
+from utime import sleep_ms
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+
+    def __init__(self, pin_id, mode: int = IN, pull: int = None, value: int = 0):
+        self.pin_id = pin_id
+        self.mode = mode
+        self._value = value
+
+    def value(self, value: int = None):
+        if value is None:
+            return self._value
+        self._value = value
+
+    def irq(self, handler=None, trigger: int = IRQ_FALLING):
+        self.handler = handler
+        self.trigger = trigger
+
+
+class SPI:
+    def __init__(self, spi_id, **kwargs):
+        self.spi_id = spi_id
+        # the data/command pin, so that transfers can be recorded as commands or data
+        self.dc_pin: Pin = None
+        self.transfers: list[tuple[bool, bytes]] = []
+
+    def init(self, **kwargs):
+        pass
+
+    def write(self, buf):
+        is_command = self.dc_pin is not None and self.dc_pin.value() == 0
+        self.transfers.append((is_command, bytes(buf)))
+
+
+# as on rp2, which has no DEEPSLEEP_RESET
+PWRON_RESET = 1
+WDT_RESET = 3
+
+
+def reset():
+    print('machine.reset() called; exiting')
+    sys.exit(0)
+
+
+def reset_cause() -> int:
+    return PWRON_RESET
+
+
+def idle():
+    pass
+
+
+def lightsleep(time_ms: int = None):
+    if time_ms is not None:
+        sleep_ms(time_ms)
+
+
+def deepsleep(time_ms: int = None):
+    print('machine.deepsleep() called; exiting')
+    sys.exit(0)
@@ -0,0 +1,8 @@
+"""
+Host stand-in for MicroPython's micropython module.
+"""
+
+
+def const(value):
+    # on a device, the compiler substitutes the value wherever the name is used
+    return value
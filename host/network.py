@@ -0,0 +1,50 @@
+"""
+Host stand-in for MicroPython's network module. The host is assumed to be online already, so connecting
+succeeds immediately.
+"""
+
+STA_IF = 0
+AP_IF = 1
+
+STAT_IDLE = 0
+STAT_CONNECTING = 1
+STAT_WRONG_PASSWORD = -3
+STAT_NO_AP_FOUND = -2
+STAT_CONNECT_FAIL = -1
+STAT_GOT_IP = 3
+
+
+class WLAN:
+    def __init__(self, interface_id: int = STA_IF):
+        self.interface_id = interface_id
+        self._active = False
+        self._connected = False
+        self._ifconfig = ('127.0.0.1', '255.0.0.0', '127.0.0.1', '127.0.0.1')
+
+    def active(self, is_active: bool = None):
+        if is_active is None:
+            return self._active
+        self._active = is_active
+
+    def connect(self, ssid: str, password: str = None, **kwargs):
+        self._connected = True
+
+    def disconnect(self):
+        self._connected = False
+
+    def isconnected(self) -> bool:
+        return self._connected
+
+    def status(self, param: str = None):
+        return STAT_GOT_IP if self._connected else STAT_IDLE
+
+    def ifconfig(self, config: tuple = None):
+        if config is None:
+            return self._ifconfig
+        self._ifconfig = config
+
+    def config(self, *args, **kwargs):
+        return None
+
+    def scan(self) -> list[tuple]:
+        return []
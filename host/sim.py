@@ -0,0 +1,203 @@
+"""
+Simulated e-ink display for running the render path on a host machine, without a Pico attached.
+
+The real EPD_2in13_V3_Landscape driver runs unmodified on top of the stand-in modules in this directory:
+SPI traffic is recorded instead of sent, delays and busy periods are added up instead of slept, and the
+framebuffer can be saved as a PNG.
+
+Usage:
+    python3 host/sim.py [--passes N] [--png PATH] [WEATHER_JSON]
+"""
+
+import argparse
+import json
+import os
+import struct
+import sys
+import time
+import zlib
+
+HOST_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(HOST_DIR)
+
+
+def install():
+    """
+    Puts the stand-in modules and the project root on the import path. The stand-ins come first, so that they
+    are used in place of the MicroPython built-ins.
+    """
+    for path in (ROOT_DIR, HOST_DIR):
+        if path in sys.path:
+            sys.path.remove(path)
+        sys.path.insert(0, path)
+
+
+install()
+
+from display import EPD_2in13_V3_Landscape  # noqa: E402
+import images  # noqa: E402
+
+# the device reads the image bundle from its working directory
+images.IMAGES_FILE = os.path.join(ROOT_DIR, images.IMAGES_FILE)
+
+# how long the panel holds BUSY after an update is activated, by display update control value
+FULL_REFRESH_MS = 2000
+PARTIAL_REFRESH_MS = 300
+PARTIAL_SETUP_MS = 40
+
+# the framebuffer is rounded up to whole bytes, but the panel only has 122 rows in landscape
+EPD_HEIGHT_VISIBLE = 122
+
+
+class SimulatedEPD(EPD_2in13_V3_Landscape):
+    """
+    The landscape e-ink driver, with the panel simulated.
+    """
+
+    def __init__(self):
+        self.reset_stats()
+        self._last_command = None
+        self._update_mode = None
+        super().__init__()
+
+        # the SPI bus needs the data/command pin to tell commands from data
+        self.spi.dc_pin = self.dc_pin
+
+    def reset_stats(self):
+        """
+        Resets the recorded traffic and timings.
+        """
+        if hasattr(self, 'spi'):
+            self.spi.transfers.clear()
+        self.delay_ms_total = 0
+        self.busy_total_ms = 0
+        self.busy_waits = 0
+        self.refreshes = 0
+        self._pending_busy_ms = 0
+
+    def delay_ms(self, delaytime):
+        self.delay_ms_total += delaytime
+
+    def send_command(self, command):
+        self._last_command = command
+        if command == 0x20:
+            # activate display update sequence
+            self.refreshes += 1
+            if self._update_mode == 0xC7:
+                self._pending_busy_ms = FULL_REFRESH_MS
+            elif self._update_mode == 0x0F:
+                self._pending_busy_ms = PARTIAL_REFRESH_MS
+            else:
+                self._pending_busy_ms = PARTIAL_SETUP_MS
+        super().send_command(command)
+
+    def send_data(self, data):
+        if self._last_command == 0x22:
+            self._update_mode = data
+        super().send_data(data)
+
+    def begin_busy(self):
+        self.busy_pending = True
+
+    def is_busy(self):
+        # simulated busy periods end straight away; wait_busy() accounts for their length
+        return False
+
+    def wait_busy(self):
+        if not self.busy_pending:
+            return
+        self.busy_waits += 1
+        self.busy_pending = False
+        self.last_busy_ms = self._pending_busy_ms
+        self.busy_total_ms += self._pending_busy_ms
+        self._pending_busy_ms = 0
+
+    def stats(self) -> dict:
+        """
+        Returns the traffic and timings recorded since the last reset.
+        """
+        transfers = self.spi.transfers
+        return {
+            'transfers': len(transfers),
+            'commands': sum(1 for is_command, _ in transfers if is_command),
+            'data_bytes': sum(len(data) for is_command, data in transfers if not is_command),
+            'refreshes': self.refreshes,
+            'busy_waits': self.busy_waits,
+            'busy_ms': self.busy_total_ms,
+            'delay_ms': self.delay_ms_total,
+        }
+
+    def save_png(self, path: str):
+        """
+        Saves the framebuffer as a PNG, cropped to the visible area of the panel.
+        :param path: the file path
+        """
+        width = self.height
+        height = EPD_HEIGHT_VISIBLE
+        rows = []
+        for y in range(height):
+            row = bytearray((width + 7) // 8)
+            offset = (y >> 3) * width
+            bit = 1 << (y & 7)
+            for x in range(width):
+                if self.buffer[offset + x] & bit:
+                    row[x >> 3] |= 0x80 >> (x & 7)
+            rows.append(bytes(row))
+        write_png(path, width, height, rows)
+
+
+def write_png(path: str, width: int, height: int, rows: list[bytes]):
+    """
+    Writes a 1-bit greyscale PNG, where a set bit is white.
+    :param path: the file path
+    :param width: the image width
+    :param height: the image height
+    :param rows: the packed rows of pixels
+    """
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+    raw = b''.join(b'\x00' + row for row in rows)
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 1, 0, 0, 0, 0)))
+        f.write(chunk(b'IDAT', zlib.compress(raw)))
+        f.write(chunk(b'IEND', b''))
+
+
+def main(args: list[str]):
+    parser = argparse.ArgumentParser(description='Renders weather on a simulated display.')
+    parser.add_argument('weather_json', nargs='?', default=os.path.join(ROOT_DIR, 'examples', 'weather.json'),
+                        help='a One Call API response')
+    parser.add_argument('--passes', type=int, default=1, help='number of render passes')
+    parser.add_argument('--png', help='save the final frame to this path')
+    opts = parser.parse_args(args)
+
+    import dashboard as app
+    from render import DisplayController
+    from weather import parse_weather
+
+    with open(opts.weather_json) as f:
+        current, daily = parse_weather(json.load(f))
+
+    epd = SimulatedEPD()
+    display = DisplayController(epd)
+
+    for n in range(opts.passes):
+        epd.reset_stats()
+        start = time.perf_counter()
+        app.render(display, current, daily)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        stats = epd.stats()
+        print(f"pass {n + 1}: host time {elapsed_ms:.1f} ms, " +
+              ', '.join(f"{key} {value}" for key, value in stats.items()), file=sys.stderr)
+
+    if opts.png:
+        epd.save_png(opts.png)
+        print(f"saved frame to {opts.png}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
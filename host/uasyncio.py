@@ -0,0 +1,10 @@
+"""
+Host stand-in for MicroPython's uasyncio module.
+"""
+
+from asyncio import *  # noqa: F401,F403
+from asyncio import sleep
+
+
+async def sleep_ms(ms: int):
+    await sleep(ms / 1000)
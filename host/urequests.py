@@ -0,0 +1,50 @@
+"""
+Host stand-in for MicroPython's urequests module, backed by urllib.
+"""
+
+import json as _json
+import urllib.error
+import urllib.request
+
+
+class Response:
+    def __init__(self, raw, status_code: int, headers: dict):
+        self.raw = raw
+        self.status_code = status_code
+        self.headers = headers
+        self._content = None
+
+    @property
+    def content(self) -> bytes:
+        if self._content is None:
+            self._content = self.raw.read()
+        return self._content
+
+    @property
+    def text(self) -> str:
+        return self.content.decode('utf-8')
+
+    def json(self):
+        return _json.loads(self.content)
+
+    def close(self):
+        self.raw.close()
+
+
+def request(method: str, url: str, data=None, json=None, headers: dict = None, **kwargs) -> Response:
+    if json is not None:
+        data = _json.dumps(json).encode('utf-8')
+    req = urllib.request.Request(url, data=data, headers=headers or {}, method=method)
+    try:
+        raw = urllib.request.urlopen(req)
+    except urllib.error.HTTPError as e:
+        raw = e
+    return Response(raw, raw.status, dict(raw.headers.items()))
+
+
+def get(url: str, **kwargs) -> Response:
+    return request('GET', url, **kwargs)
+
+
+def post(url: str, **kwargs) -> Response:
+    return request('POST', url, **kwargs)
@@ -0,0 +1,44 @@
+"""
+Host stand-in for MicroPython's utime module.
+"""
+
+import time as _time
+
+_start = _time.monotonic_ns()
+
+
+def sleep(seconds: float):
+    _time.sleep(seconds)
+
+
+def sleep_ms(ms: int):
+    _time.sleep(ms / 1000)
+
+
+def sleep_us(us: int):
+    _time.sleep(us / 1_000_000)
+
+
+def ticks_ms() -> int:
+    return (_time.monotonic_ns() - _start) // 1_000_000
+
+
+def ticks_us() -> int:
+    return (_time.monotonic_ns() - _start) // 1_000
+
+
+def ticks_add(ticks: int, delta: int) -> int:
+    return ticks + delta
+
+
+def ticks_diff(ticks1: int, ticks2: int) -> int:
+    return ticks1 - ticks2
+
+
+def time() -> int:
+    return int(_time.time())
+
+
+def localtime(secs: int = None) -> tuple:
+    # the device RTC has no time zone, so behave like gmtime
+    return tuple(_time.gmtime(secs))[:8]
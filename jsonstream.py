@@ -0,0 +1,272 @@
+"""
+Incremental JSON parser that reads from a stream in small chunks, and only builds the values selected by a spec.
+
+A spec describes which parts of a value to keep:
+
+- True keeps the whole value
+- a dict with string keys keeps only those keys of an object, each with its own spec
+- a dict with integer keys keeps only those elements of an array, returned as a list in index order
+- a list holding one spec keeps every element of an array, each with that spec
+- a callable keeps the whole value and is called with it; its result is kept in place of the value, and it can raise
+  to abandon the parse
+- StopAfter(spec) keeps the value with the given spec, then stops: the rest of the document is left unread
+
+Everything else is skipped as it is read, so memory use is bounded by the selected values rather than the size of
+the document.
+"""
+
+# bytes that can appear in a JSON number
+_NUMBER_BYTES = b'+-0123456789.eE'
+
+_ESCAPES = {
+    ord('"'): '"',
+    ord('\\'): '\\',
+    ord('/'): '/',
+    ord('b'): '\b',
+    ord('f'): '\f',
+    ord('n'): '\n',
+    ord('r'): '\r',
+    ord('t'): '\t',
+}
+
+
+class StopAfter:
+    """
+    Spec wrapper that ends the parse once its value has been read, so the rest of the document isn't downloaded.
+    """
+
+    def __init__(self, spec=True):
+        self.spec = spec
+
+
+class JsonStream:
+    """
+    Reads JSON tokens from a stream with a fixed size buffer.
+    """
+
+    def __init__(self, stream, chunk_size: int = 256):
+        """
+        :param stream: a stream supporting readinto(), such as a socket
+        :param chunk_size: the number of bytes to read at a time
+        """
+        self.stream = stream
+        self.buf = bytearray(chunk_size)
+        self.pos = 0
+        self.end = 0
+        self.bytes_read = 0
+        self.stopped = False
+
+    def _fill(self):
+        self.end = self.stream.readinto(self.buf) or 0
+        self.pos = 0
+        if self.end == 0:
+            raise ValueError('unexpected end of JSON')
+        self.bytes_read += self.end
+
+    def next_byte(self) -> int:
+        """
+        Consumes and returns the next byte.
+        """
+        if self.pos >= self.end:
+            self._fill()
+        b = self.buf[self.pos]
+        self.pos += 1
+        return b
+
+    def peek(self) -> int:
+        """
+        Skips whitespace and returns the next byte without consuming it.
+        """
+        while True:
+            if self.pos >= self.end:
+                self._fill()
+            b = self.buf[self.pos]
+            if b not in b' \t\r\n':
+                return b
+            self.pos += 1
+
+    def expect(self, expected: int):
+        """
+        Consumes the next non-whitespace byte, which must be the one given.
+        """
+        b = self.peek()
+        if b != expected:
+            raise ValueError(f"expected '{chr(expected)}' but found '{chr(b)}'")
+        self.pos += 1
+
+    def read_string(self, keep: bool = True) -> str:
+        """
+        Reads a string, returning it if keep is set, otherwise skipping it.
+        """
+        self.expect(ord('"'))
+        chars = bytearray() if keep else None
+        while True:
+            b = self.next_byte()
+            if b == ord('"'):
+                return chars.decode('utf-8') if keep else None
+
+            if b == ord('\\'):
+                b = self.next_byte()
+                if b == ord('u'):
+                    code = int(bytes(self.next_byte() for _ in range(4)), 16)
+                    if keep:
+                        chars.extend(chr(code).encode('utf-8'))
+                    continue
+                if keep:
+                    chars.extend(_ESCAPES[b].encode('utf-8'))
+            elif keep:
+                chars.append(b)
+
+    def read_number(self):
+        """
+        Reads a number, returning an int or a float.
+        """
+        self.peek()
+        digits = bytearray()
+        while True:
+            if self.pos >= self.end:
+                self._fill()
+            b = self.buf[self.pos]
+            if b not in _NUMBER_BYTES:
+                break
+            digits.append(b)
+            self.pos += 1
+
+        text = digits.decode()
+        for c in '.eE':
+            if c in text:
+                return float(text)
+        return int(text)
+
+    def read_literal(self):
+        """
+        Reads true, false or null.
+        """
+        b = self.peek()
+        if b == ord('t'):
+            word, value = b'true', True
+        elif b == ord('f'):
+            word, value = b'false', False
+        elif b == ord('n'):
+            word, value = b'null', None
+        else:
+            raise ValueError(f"unexpected '{chr(b)}'")
+
+        for expected in word:
+            if self.next_byte() != expected:
+                raise ValueError('invalid literal')
+        return value
+
+    def skip_value(self):
+        """
+        Skips a value of any type without building it.
+        """
+        depth = 0
+        while True:
+            b = self.peek()
+            if b == ord('"'):
+                self.read_string(keep=False)
+            elif b in b'{[':
+                self.pos += 1
+                depth += 1
+            elif b in b'}]':
+                self.pos += 1
+                depth -= 1
+            elif b in b',:':
+                self.pos += 1
+            elif b in _NUMBER_BYTES:
+                self.read_number()
+            else:
+                self.read_literal()
+
+            if depth == 0:
+                return
+
+    def read_value(self, spec=True):
+        """
+        Reads a value, keeping only the parts selected by the spec.
+        """
+        if isinstance(spec, StopAfter):
+            value = self.read_value(spec.spec)
+            self.stopped = True
+            return value
+        if callable(spec):
+            return spec(self.read_value())
+
+        b = self.peek()
+        if b == ord('{'):
+            return self._read_object(spec)
+        elif b == ord('['):
+            return self._read_array(spec)
+        elif b == ord('"'):
+            return self.read_string()
+        elif b in _NUMBER_BYTES:
+            return self.read_number()
+        else:
+            return self.read_literal()
+
+    def _read_object(self, spec) -> dict:
+        result = {}
+        self.expect(ord('{'))
+        if self.peek() == ord('}'):
+            self.pos += 1
+            return result
+
+        while True:
+            key = self.read_string()
+            self.expect(ord(':'))
+
+            if spec is True:
+                result[key] = self.read_value()
+            elif isinstance(spec, dict) and key in spec:
+                result[key] = self.read_value(spec[key])
+            else:
+                self.skip_value()
+            if self.stopped:
+                return result
+
+            b = self.peek()
+            self.pos += 1
+            if b == ord('}'):
+                return result
+            if b != ord(','):
+                raise ValueError(f"expected ',' or '}}' but found '{chr(b)}'")
+
+    def _read_array(self, spec) -> list:
+        result = []
+        self.expect(ord('['))
+        if self.peek() == ord(']'):
+            self.pos += 1
+            return result
+
+        index = 0
+        while True:
+            if spec is True:
+                result.append(self.read_value())
+            elif isinstance(spec, list):
+                result.append(self.read_value(spec[0]))
+            elif isinstance(spec, dict) and index in spec:
+                result.append(self.read_value(spec[index]))
+            else:
+                self.skip_value()
+            if self.stopped:
+                return result
+            index += 1
+
+            b = self.peek()
+            self.pos += 1
+            if b == ord(']'):
+                return result
+            if b != ord(','):
+                raise ValueError(f"expected ',' or ']' but found '{chr(b)}'")
+
+
+def parse(stream, spec=True, chunk_size: int = 256):
+    """
+    Parses a JSON document from the given stream, keeping only the parts selected by the spec.
+    :param stream: a stream supporting readinto(), such as a socket
+    :param spec: the parts of the document to keep
+    :param chunk_size: the number of bytes to read at a time
+    :return: the selected value
+    """
+    return JsonStream(stream, chunk_size).read_value(spec)
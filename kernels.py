@@ -0,0 +1,67 @@
+"""
+The byte loops over framebuffers that run on every flush and every delta, compiled to machine code where the port
+allows it.
+
+Each kernel has a pure Python version here, which runs under CPython and on ports built without the native emitter,
+and @micropython.native and @micropython.viper versions in kernels_native.py. The fastest variant that loads is chosen
+at import time.
+"""
+
+
+def first_diff(a, b, start: int, end: int) -> int:
+    """
+    Returns the first index in [start, end] at which the two buffers differ, or end + 1 if they are equal there.
+    :param a: the first buffer
+    :param b: the second buffer
+    :param start: the first index to compare
+    :param end: the last index to compare
+    """
+    while start <= end and a[start] == b[start]:
+        start += 1
+    return start
+
+
+def last_diff(a, b, start: int, end: int) -> int:
+    """
+    Returns the last index in [start, end] at which the two buffers differ, or start - 1 if they are equal there.
+    :param a: the first buffer
+    :param b: the second buffer
+    :param start: the first index to compare
+    :param end: the last index to compare
+    """
+    while end >= start and a[end] == b[end]:
+        end -= 1
+    return end
+
+
+def xor_into(dst, offset: int, src, length: int):
+    """
+    XORs the first bytes of src into dst, from the given offset.
+    :param dst: the buffer to change
+    :param offset: the index in dst of the first byte to change
+    :param src: the bytes to XOR in
+    :param length: the number of bytes
+    """
+    for i in range(length):
+        dst[offset + i] ^= src[i]
+
+
+# the (first_diff, last_diff, xor_into) kernels of each variant that loads, fastest first; a list, as MicroPython's
+# dicts are unordered
+VARIANTS = []
+
+try:
+    import kernels_native
+
+    VARIANTS.append(('viper', (kernels_native.viper_first_diff, kernels_native.viper_last_diff,
+                               kernels_native.viper_xor_into)))
+    VARIANTS.append(('native', (kernels_native.native_first_diff, kernels_native.native_last_diff,
+                                kernels_native.native_xor_into)))
+except (ImportError, AttributeError, NameError, SyntaxError, ValueError):
+    # CPython, or a port without the native emitter
+    pass
+
+VARIANTS.append(('python', (first_diff, last_diff, xor_into)))
+
+VARIANT = VARIANTS[0][0]
+first_diff, last_diff, xor_into = VARIANTS[0][1]
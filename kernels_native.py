@@ -0,0 +1,56 @@
+"""
+Native and viper versions of the kernels in kernels.py, which chooses between them. Only MicroPython can load this
+module; under CPython, the decorators don't exist.
+
+The viper versions read the buffers through raw ptr8 pointers, without bounds checks or boxing each byte, so callers
+pass indices that are in range. Viper functions take at most four arguments, so xor_into() takes its source already
+sliced.
+"""
+
+import micropython
+
+
+@micropython.native
+def native_first_diff(a, b, start: int, end: int) -> int:
+    while start <= end and a[start] == b[start]:
+        start += 1
+    return start
+
+
+@micropython.native
+def native_last_diff(a, b, start: int, end: int) -> int:
+    while end >= start and a[end] == b[end]:
+        end -= 1
+    return end
+
+
+@micropython.native
+def native_xor_into(dst, offset: int, src, length: int):
+    for i in range(length):
+        dst[offset + i] ^= src[i]
+
+
+@micropython.viper
+def viper_first_diff(a: ptr8, b: ptr8, start: int, end: int) -> int:
+    i = start
+    while i <= end:
+        if a[i] != b[i]:
+            break
+        i += 1
+    return i
+
+
+@micropython.viper
+def viper_last_diff(a: ptr8, b: ptr8, start: int, end: int) -> int:
+    i = end
+    while i >= start:
+        if a[i] != b[i]:
+            break
+        i -= 1
+    return i
+
+
+@micropython.viper
+def viper_xor_into(dst: ptr8, offset: int, src: ptr8, length: int):
+    for i in range(length):
+        dst[offset + i] = dst[offset + i] ^ src[i]
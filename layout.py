@@ -0,0 +1,346 @@
+"""
+Retained-mode layout for the display.
+
+A screen is a tree of nodes: rows and columns arrange their children, and text, icons, separators and spacers draw
+themselves. Each node measures itself once and caches the result until its content changes; changing a node's
+content invalidates it and its ancestors, so the next layout pass only revisits the subtrees that changed. Drawing
+then only clears and redraws the nodes that changed or moved, along with anything they overlap.
+"""
+
+from images import show_image, image_size, IMAGE_DIM
+from render import DisplayController, CHAR_WIDTH, CHAR_HEIGHT
+
+ALIGN_LEFT = 0
+ALIGN_RIGHT = 1
+
+# line height for text with a small gap between lines
+LINE_HEIGHT = 10
+
+# line height for text with no gap between lines
+LINE_HEIGHT_THIN = 8
+
+
+def _intersects(a: tuple, b: tuple) -> bool:
+    return a[0] < b[0] + b[2] and b[0] < a[0] + a[2] and a[1] < b[1] + b[3] and b[1] < a[1] + a[3]
+
+
+def _clip(box: tuple, width: int, height: int) -> tuple:
+    x0, y0 = max(box[0], 0), max(box[1], 0)
+    return x0, y0, min(box[0] + box[2], width) - x0, min(box[1] + box[3], height) - y0
+
+
+class Node:
+    """
+    A node in the layout tree.
+    """
+    parent = None
+
+    def __init__(self, margin_top: int = 0):
+        """
+        :param margin_top: space above the node; may be negative, to overlap whatever is above
+        """
+        self.margin_top = margin_top
+        self.x = self.y = self.width = self.height = 0
+        self._size = None
+        self.needs_layout = True
+        self.needs_draw = True
+        self.drawn = None
+
+    def invalidate(self):
+        """
+        Records that the node's content has changed, so it is measured and drawn again, along with any ancestors
+        whose size depends on it.
+        """
+        self.needs_draw = True
+        node = self
+        while node is not None:
+            node._size = None
+            node.needs_layout = True
+            node = node.parent
+
+    def invalidate_all(self):
+        """
+        Records that the whole subtree needs drawing again, e.g. because the framebuffer was cleared.
+        """
+        self.needs_draw = True
+        self.needs_layout = True
+        self.drawn = None
+
+    def size(self) -> tuple[int, int]:
+        """
+        Returns the natural (width, height) of the node, measuring it if its content has changed.
+        """
+        if self._size is None:
+            self._size = self.measure()
+        return self._size
+
+    def measure(self) -> tuple[int, int]:
+        return 0, 0
+
+    def place(self, x: int, y: int, width: int):
+        """
+        Positions the node. A node that moves or changes size is drawn again.
+        :param x: x coordinate
+        :param y: y coordinate, including the top margin
+        :param width: the width given to the node by its parent
+        """
+        height = self.size()[1]
+        if x != self.x or y != self.y or width != self.width or height != self.height:
+            self.x, self.y, self.width, self.height = x, y, width, height
+            self.needs_draw = True
+        self.needs_layout = False
+
+    def box(self) -> tuple[int, int, int, int]:
+        """
+        Returns the area the node draws into, as (x, y, width, height).
+        """
+        return self.x, self.y, self.width, self.height
+
+    def nodes(self):
+        yield self
+
+    def draw(self, display: DisplayController):
+        pass
+
+
+class Container(Node):
+    """
+    A node that arranges other nodes.
+    """
+
+    def __init__(self, children: list = None, margin_top: int = 0):
+        super().__init__(margin_top)
+        self.children = []
+        self.removed = []
+        self.set_children(children or [])
+
+    def set_children(self, children: list):
+        """
+        Replaces the children of this node. The areas drawn by removed children are cleared on the next draw.
+        :param children: the new children
+        """
+        for child in self.children:
+            if child not in children:
+                for node in child.nodes():
+                    if node.drawn:
+                        self.removed.append(node.drawn)
+                    node.drawn = None
+                child.parent = None
+
+        self.children = children
+        for child in children:
+            child.parent = self
+        self.invalidate()
+
+    def invalidate_all(self):
+        super().invalidate_all()
+        for child in self.children:
+            child.invalidate_all()
+
+    def place(self, x: int, y: int, width: int):
+        if not self.needs_layout and x == self.x and y == self.y and width == self.width:
+            # nothing in this subtree has changed
+            return
+        self.x, self.y, self.width = x, y, width
+        self.height = self.size()[1]
+        self.arrange()
+        self.needs_layout = False
+
+    def arrange(self):
+        pass
+
+    def nodes(self):
+        yield self
+        for child in self.children:
+            yield from child.nodes()
+
+
+class Column(Container):
+    """
+    Stacks its children from top to bottom, each as wide as the column.
+    """
+
+    def __init__(self, children: list = None, padding_top: int = 0, margin_top: int = 0):
+        self.padding_top = padding_top
+        super().__init__(children, margin_top)
+
+    def measure(self) -> tuple[int, int]:
+        width = 0
+        height = self.padding_top
+        for child in self.children:
+            child_width, child_height = child.size()
+            width = max(width, child_width)
+            height += child.margin_top + child_height
+        return width, height
+
+    def arrange(self):
+        y = self.y + self.padding_top
+        for child in self.children:
+            y += child.margin_top
+            child.place(self.x, y, self.width)
+            y += child.height
+
+
+class Row(Container):
+    """
+    Places its children from left to right at their natural width. The last child takes the rest of the row.
+    """
+
+    def __init__(self, children: list = None, gap: int = 0, margin_top: int = 0):
+        self.gap = gap
+        super().__init__(children, margin_top)
+
+    def measure(self) -> tuple[int, int]:
+        width = 0
+        height = 0
+        for child in self.children:
+            child_width, child_height = child.size()
+            width += child_width
+            height = max(height, child.margin_top + child_height)
+        if self.children:
+            width += self.gap * (len(self.children) - 1)
+        return width, height
+
+    def arrange(self):
+        x = self.x
+        last = len(self.children) - 1
+        for i, child in enumerate(self.children):
+            width = self.x + self.width - x if i == last else child.size()[0]
+            child.place(x, self.y + child.margin_top, width)
+            x += width + self.gap
+
+
+class Text(Node):
+    """
+    Lines of text, each in a line of the given height with the characters at the bottom.
+    """
+
+    def __init__(self, *lines: str, line_height: int = LINE_HEIGHT, align: int = ALIGN_LEFT, margin_top: int = 0):
+        super().__init__(margin_top)
+        self.lines = lines
+        self.line_height = line_height
+        self.align = align
+
+    def set(self, *lines: str):
+        """
+        Sets the lines of text, if they have changed.
+        """
+        if lines != self.lines:
+            self.lines = lines
+            self.invalidate()
+
+    def measure(self) -> tuple[int, int]:
+        width = max([len(line) for line in self.lines] or [0]) * CHAR_WIDTH
+        return width, len(self.lines) * self.line_height
+
+    def box(self) -> tuple[int, int, int, int]:
+        # lines aren't clipped to the width the node is given, e.g. a description wrapped to the screen width beside
+        # the images, so the box covers everything drawn
+        natural_width = self.size()[0]
+        if natural_width <= self.width:
+            return self.x, self.y, self.width, self.height
+        x = self.x + self.width - natural_width if self.align == ALIGN_RIGHT else self.x
+        return x, self.y, natural_width, self.height
+
+    def draw(self, display: DisplayController):
+        y = self.y + self.line_height - CHAR_HEIGHT
+        for line in self.lines:
+            x = self.x
+            if self.align == ALIGN_RIGHT:
+                x += self.width - len(line) * CHAR_WIDTH
+            display.text(line, x, y)
+            y += self.line_height
+
+
+class Icon(Node):
+    """
+    One of the weather images.
+    """
+
+    def __init__(self, img_path: str, dim: int = IMAGE_DIM, margin_top: int = 0):
+        super().__init__(margin_top)
+        self.img_path = img_path
+        self.dim = dim
+
+    def measure(self) -> tuple[int, int]:
+        return image_size(self.img_path, self.dim)
+
+    def box(self) -> tuple[int, int, int, int]:
+        width, height = self.size()
+        return self.x, self.y, width, height
+
+    def draw(self, display: DisplayController):
+        show_image(display, self.img_path, self.x, self.y, self.dim)
+
+
+class Separator(Node):
+    """
+    A horizontal line across the width of its parent, with space above and below.
+    """
+
+    def measure(self) -> tuple[int, int]:
+        return 0, 4
+
+    def box(self) -> tuple[int, int, int, int]:
+        # the line is offset by a pixel from the left edge
+        return self.x, self.y, self.width + 1, self.height
+
+    def draw(self, display: DisplayController):
+        display.hline(self.x + 1, self.y + 2, self.width)
+
+
+class Spacer(Node):
+    """
+    Empty vertical space.
+    """
+
+    def __init__(self, height: int):
+        super().__init__()
+        self.space = height
+
+    def measure(self) -> tuple[int, int]:
+        return 0, self.space
+
+
+def show(display: DisplayController, root: Node):
+    """
+    Lays out the given tree and draws it to the display framebuffer. If the tree is already showing, only the nodes
+    that changed or moved are drawn; otherwise the framebuffer is blanked and the whole tree is drawn.
+    :param display: the display controller
+    :param root: the root of the tree
+    """
+    if display.shown is not root:
+        display.blank()
+        root.invalidate_all()
+        display.shown = root
+
+    root.place(0, 0, DisplayController.MAX_TEXT_WIDTH * CHAR_WIDTH)
+
+    nodes = list(root.nodes())
+    cleared = []
+    for node in nodes:
+        if isinstance(node, Container):
+            cleared.extend(node.removed)
+            node.removed = []
+        elif node.needs_draw:
+            if node.drawn:
+                cleared.append(node.drawn)
+            cleared.append(node.box())
+
+    cleared = [_clip(box, display.screen_width, display.screen_height) for box in cleared]
+    cleared = [box for box in cleared if box[2] > 0 and box[3] > 0]
+    if not cleared:
+        return
+
+    for box in cleared:
+        display.fill_rect(box[0], box[1], box[2], box[3], 0xff)
+
+    # redraw whatever changed, and anything overlapping the cleared areas
+    for node in nodes:
+        if isinstance(node, Container):
+            continue
+        box = node.box()
+        if node.needs_draw or any(_intersects(box, area) for area in cleared):
+            node.draw(display)
+            node.drawn = box
+            node.needs_draw = False
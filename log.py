@@ -0,0 +1,70 @@
+"""
+Leveled logging to the console.
+
+Messages are passed as a format string and arguments, and only formatted if their level is enabled, so a disabled
+message costs a function call and no string building. For messages on hot paths, modules also guard the call with
+a private `_DEBUG = const(0)` flag; mpy-cross drops code under a false constant, so those messages cost nothing at
+all unless the flag is set and the module recompiled.
+"""
+
+from micropython import const
+
+DEBUG = const(10)
+INFO = const(20)
+WARNING = const(30)
+ERROR = const(40)
+
+LEVELS = {
+    'debug': DEBUG,
+    'info': INFO,
+    'warning': WARNING,
+    'error': ERROR,
+}
+
+DEFAULT_LEVEL = WARNING
+
+# messages below this level are dropped; over a UART console every printed line adds to the awake time
+level = DEFAULT_LEVEL
+
+
+def set_level(name: str):
+    """
+    Sets the level by name, e.g. 'info'. An unknown name falls back to the default level with a warning, so a typo in
+    the configuration doesn't stop the device.
+    :param name: the level name
+    """
+    global level
+    new_level = LEVELS.get(name.strip().lower())
+    if new_level is None:
+        level = DEFAULT_LEVEL
+        warning("unknown log level '%s'; using 'warning'", name)
+        return
+    level = new_level
+
+
+def enabled(msg_level: int) -> bool:
+    """
+    Returns whether messages at the given level are printed, for callers that need to do work to build them.
+    """
+    return msg_level >= level
+
+
+def _log(msg_level: int, msg: str, args: tuple):
+    if msg_level >= level:
+        print(msg % args if args else msg)
+
+
+def debug(msg: str, *args):
+    _log(DEBUG, msg, args)
+
+
+def info(msg: str, *args):
+    _log(INFO, msg, args)
+
+
+def warning(msg: str, *args):
+    _log(WARNING, msg, args)
+
+
+def error(msg: str, *args):
+    _log(ERROR, msg, args)
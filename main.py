@@ -1,166 +1,258 @@
 import machine
+import uasyncio as asyncio
 import utime
 
+from dashboard import render, show_status
 from display import EPD_2in13_V3_Landscape
-from images import show_image, IMAGE_DIM
-from net import connect_to_network, disconnect
+from frames import fetch_frame, load_frame, save_frame
+import log
+from net import connect_to_network, disconnect, timings as network_timings
+import profiler
+from power import State, load_state, save_state, sleep, report_awake, woke_from_deep_sleep, SLEEP_MODE_DEEP
 from render import DisplayController
-from utils import format_date, read_config, wrap_text, sentence_join, Config, truncate_lines
-from weather import get_img_for_title, Weather, load_cached_weather, fetch_weather, \
-    cache_weather
+from utils import read_config, Config
+from weather import Weather, load_cached_weather, fetch_weather, fetch_weather_from_gateway, \
+    cache_weather, cache_stored_at, renew_cached_weather, is_fresh
 
 
-def fetch(config: Config, display: DisplayController) -> tuple[Weather, Weather]:
+async def fetch(config: Config, display: DisplayController, state: State) -> tuple[Weather, Weather]:
     """
-    First tries to load the weather from the cache. If it's not there, connects to the configured network, fetches the
-    weather, disconnects, and caches the weather.
+    First tries to load the weather from the cache, in memory then on flash. If it's not there, connects to the
+    configured network, fetches the weather, disconnects, and caches the weather.
+
+    The state saved at the last fetch says whether the cache is still fresh, and which weather it holds, so the cache
+    file is only read when its weather is needed.
+
+    The radio associates in the background while the status screen is drawn, and the HTTP fetch runs while the
+    panel shows the connected status. The status screens are only shown when there is no earlier weather on the
+    panel. If the remote weather hasn't changed since the expired cache, the cached weather is renewed rather than
+    written again.
     :param config: the configuration
     :param display: the display controller
+    :param state: the state saved at the last fetch
     :return: the current and daily weather
     """
-    current: Weather = load_cached_weather('current', config.cache_mins)
-    daily: Weather = load_cached_weather('daily', config.cache_mins)
+    if state.last_fetch:
+        cached = load_cached_weather(None) if is_fresh(state.last_fetch, config.cache_mins) else None
+    else:
+        cached = load_cached_weather(config.cache_mins)
 
-    if all([current, daily]):
-        print(f"using cached weather")
-        return current, daily
+    if cached:
+        log.info("using cached weather")
+        return cached
     else:
-        print(f"no cached weather found; fetching from remote")
+        log.info("no cached weather found; fetching from remote")
 
-    display.display_text(
-        DisplayController.RENDER_FLAG_BLANK | DisplayController.RENDER_FLAG_FLUSH,
-        f"Connecting to {config.ssid}..."
-    )
+    # the expired weather is still on the panel, and tells the remote what we already have; it is only loaded if the
+    # remote says it hasn't changed
+    if state.last_dt:
+        previous = None
+        last_dt = state.last_dt
+    else:
+        previous = load_cached_weather(None)
+        last_dt = previous[0].dt if previous else 0
+    first_fetch = last_dt == 0
 
-    try:
-        wlan, ip = connect_to_network(config.ssid, config.password)
-    except KeyboardInterrupt:
-        print('received keyboard interrupt when connecting to network')
-        machine.reset()
+    def fetch_remote(since_dt: int) -> tuple[Weather, Weather]:
+        if config.weather_gateway:
+            return fetch_weather_from_gateway(config.weather_gateway, config.lat, config.lon, since_dt)
+        return fetch_weather(config.lat, config.lon, config.openweathermap_key, since_dt)
+
+    connection = asyncio.create_task(connect(config))
+    # let the connection start before drawing
+    await asyncio.sleep_ms(0)
+
+    if first_fetch:
+        show_status(display, f"Connecting to {config.ssid}...")
+
+    wlan, ip = await wait_for_connection(connection, display, state)
 
-    display.display_text(
-        DisplayController.RENDER_FLAG_FLUSH,
-        "Connected",
-        f"IP: {ip}"
-    )
+    if first_fetch:
+        await display.wait_until_idle_async()
+        show_status(display, "Connected", f"IP: {ip}", append=True)
 
+    current = daily = None
     try:
-        current, daily = fetch_weather(config.lat, config.lon, config.openweathermap_key)
+        with profiler.span('fetch_weather'):
+            fetched = fetch_remote(last_dt)
+            if fetched is None:
+                previous = previous or load_cached_weather(None)
+                if previous is None:
+                    log.warning("cached weather is missing; fetching it again")
+                    fetched = fetch_remote(0)
+        current, daily = fetched or previous
     except Exception as e:
-        print(f"error fetching weather: {e}")
-        display.display_text(
-            DisplayController.RENDER_FLAG_FLUSH,
-            "Failed to fetch weather",
-            f"Cause: {e}"
-        )
+        log.error("error fetching weather: %s", e)
+        show_status(display, "Failed to fetch weather", f"Cause: {e}", append=True)
         display.deep_sleep()
     finally:
         # we don't need the network anymore
         disconnect(wlan)
+        log.info("network timings (ms): %s", network_timings)
 
         if not all([current, daily]):
-            print(f"Sleeping for 5 minutes then resetting the device")
-            utime.sleep(300)
-            machine.reset()
+            reset_later(state, display)
+
+    if fetched is None:
+        renew_cached_weather(current, daily)
+        return current, daily
 
-    cache_weather(current, 'current')
-    cache_weather(daily, 'daily')
+    with profiler.span('cache_weather'):
+        cache_weather(current, daily)
 
     return current, daily
 
 
-def render(display: DisplayController, current: Weather, daily: Weather):
+async def fetch_rendered(config: Config, display: DisplayController, state: State) -> bool:
     """
-    Renders the given weather on the display.
+    Connects to the configured network, fetches the frame rendered by the gateway into the framebuffer, and
+    disconnects. There is nothing to parse or lay out; the gateway caches the weather, so nothing is cached here.
+
+    The frame on the panel is loaded from flash while the radio associates, so the gateway only needs to send what
+    changed in it.
+    :param config: the configuration
     :param display: the display controller
-    :param current: the current weather
-    :param daily: the daily weather
+    :param state: the state
+    :return: whether the frame differs from the one on the panel, and needs to be flushed
     """
-    weather_date = format_date(current.dt)
-
-    display.display_text(
-        DisplayController.RENDER_FLAG_CLEAR | DisplayController.RENDER_FLAG_BLANK | DisplayController.RENDER_FLAG_THIN_PADDING,
-        "NOW"
-    )
-    display.display_right(
-        DisplayController.RENDER_FLAG_APPEND_ONLY | DisplayController.RENDER_FLAG_NO_V_CURSOR,
-        weather_date
-    )
-    render_weather(display, current)
-
-    display.render_horizontal_separator()
-    display.display_text(DisplayController.RENDER_FLAG_APPEND_ONLY, "TODAY")
-    display.add_vertical_space(2)
-
-    today_summary = truncate_lines(daily.day_summary, 3)
-    display.display_text(
-        DisplayController.RENDER_FLAG_APPEND_ONLY,
-        *today_summary
-    )
-    display.add_vertical_space(4)
-    render_weather(display, daily, show_min_max=True)
-
-    display.flush_display()
-
-
-def render_weather(display: DisplayController, weather: Weather, show_min_max: bool = False):
+    connection = asyncio.create_task(connect(config))
+    # let the connection start before reading flash
+    await asyncio.sleep_ms(0)
+    has_base = display.last_frame is not None or load_frame(display)
+    wlan, ip = await wait_for_connection(connection, display, state)
+
+    changed = None
+    try:
+        with profiler.span('fetch_frame'):
+            changed = fetch_frame(config.weather_gateway, config.lat, config.lon, display, has_base)
+    except Exception as e:
+        log.error("error fetching frame: %s", e)
+        show_status(display, "Failed to fetch weather", f"Cause: {e}")
+        display.deep_sleep()
+    finally:
+        # we don't need the network anymore
+        disconnect(wlan)
+        log.info("network timings (ms): %s", network_timings)
+
+        if changed is None:
+            reset_later(state, display)
+
+    return changed
+
+
+async def connect(config: Config) -> tuple:
     """
-    Renders the given weather on the display.
-    :param display: the display controller
-    :param weather: the weather
-    :param show_min_max: whether to show the min/max temperatures
+    Connects to the configured network, and returns the WLAN client and IP address.
+    :param config: the configuration
     """
-    image_x = 0
-    image_y = display.get_last_text_y() + 7
-
-    img_paths = []
-    for title in weather.titles:
-        img_path = get_img_for_title(title)
-        if img_path:
-            img_paths.append(img_path)
-
-    for img_path in set(img_paths):
-        show_image(display, img_path, image_x, image_y)
-        image_x += IMAGE_DIM + 4
-
-    temp = f"{weather.temp.main:.1f} C"
-    title = sentence_join(weather.titles)
-    desc = wrap_text(weather.description, DisplayController.MAX_TEXT_WIDTH)
-
-    # render to the right of the image (image_x)
-    display.display_text_at_coordinates(
-        DisplayController.RENDER_FLAG_APPEND_ONLY,
-        image_x,
-        temp,
-    )
-
-    if show_min_max:
-        display.display_right(
-            DisplayController.RENDER_FLAG_APPEND_ONLY,
-            f"L/H: {weather.temp.temp_min:.1f}-{weather.temp.temp_max:.1f} C"
+    static_ifconfig = None
+    if config.static_ip:
+        static_ifconfig = (config.static_ip, config.netmask, config.gateway, config.dns or config.gateway)
+
+    try:
+        return await connect_to_network(
+            config.ssid, config.password, config.wifi_timeout_secs, static_ifconfig, config.reuse_lease
         )
+    except KeyboardInterrupt:
+        log.error('received keyboard interrupt when connecting to network')
+        machine.reset()
+
 
-    display.display_text_at_coordinates(
-        DisplayController.RENDER_FLAG_APPEND_ONLY,
-        image_x,
-        title,
-        *desc,
-    )
+async def wait_for_connection(connection, display: DisplayController, state: State) -> tuple:
+    """
+    Waits for the connection started by connect(), and returns the WLAN client and IP address. If it fails, shows the
+    failure and resets the device later to try again.
+    :param connection: the task running connect()
+    :param display: the display controller
+    :param state: the state
+    """
+    try:
+        return await connection
+    except OSError as e:
+        log.error("error connecting to network: %s", e)
+        show_status(display, "Failed to connect", f"Cause: {e}")
+        display.deep_sleep()
+        reset_later(state, display)
 
 
-def main():
+def reset_later(state: State, display: DisplayController):
+    """
+    Saves the state, with the hash of the frame on the panel, then waits for 5 minutes and resets the device to try
+    again.
+    :param state: the state
+    :param display: the display controller
+    """
+    state.frame_hash = display.frame_hash
+    save_state(state)
+    log.error("sleeping for 5 minutes then resetting the device")
+    utime.sleep(300)
+    machine.reset()
+
+
+async def run():
+    # ticks start at boot, so the first cycle's awake time includes startup
+    cycle_start = 0
+
     config = read_config()
+    log.set_level(config.log_level)
+    if config.profile:
+        profiler.enable()
+    state = load_state()
+    if woke_from_deep_sleep(state):
+        log.info("woke from deep sleep; last awake for %d ms", state.awake_ms)
+
+    saved_hash = state.frame_hash
+
     epd = EPD_2in13_V3_Landscape()
-    display = DisplayController(epd)
+    display = DisplayController(epd, config.full_refresh_every, state.frame_hash)
 
     while True:
+        # the panel is only woken if something is drawn to it
         display.init()
-        current, daily = fetch(config, display)
-        render(display, current, daily)
-        display.deep_sleep()
+        profiler.heap('start')
+        with profiler.span('fetch'):
+            if config.gateway_frames:
+                current = None
+                changed = await fetch_rendered(config, display, state)
+            else:
+                current, daily = await fetch(config, display, state)
+                # drawn even if the weather hasn't changed, as the panel may be showing a status screen; if it already
+                # shows this weather, the flush finds the frame unchanged and leaves the panel alone
+                changed = True
+        profiler.heap('fetched')
 
-        print(f'sleeping for {config.refresh_mins} minutes')
-        utime.sleep(config.refresh_mins * 60)
+        if changed:
+            with profiler.span('render'):
+                if current:
+                    render(display, current, daily)
+                else:
+                    display.flush_display()
+                    save_frame(display)
+            profiler.heap('rendered')
+            await display.wait_until_idle_async()
+            display.deep_sleep()
+        else:
+            log.info("frame unchanged; leaving the display as it is")
+
+        if current:
+            state.last_fetch = cache_stored_at()
+            state.last_dt = current.dt
+        report_awake(state, cycle_start)
+        profiler.end_cycle(state.awake_ms)
+
+        state.frame_hash = display.frame_hash
+        if config.sleep_mode == SLEEP_MODE_DEEP or state.frame_hash != saved_hash:
+            # nothing survives a deep sleep except the saved state; in the other modes it is only read after a reset,
+            # so it is saved when the frame on the panel changes
+            save_state(state)
+            saved_hash = state.frame_hash
+
+        sleep(config.sleep_mode, config.refresh_mins * 60)
+        cycle_start = utime.ticks_ms()
+
+
+def main():
+    asyncio.run(run())
 
 
 if __name__ == '__main__':
@@ -1,32 +1,188 @@
+import binascii
 import network
+import os
+import uasyncio as asyncio
 import utime
 
+import log
+import profiler
+from utils import file_exists
 
-def connect_to_network(ssid: str, password: str) -> tuple[network.WLAN, str]:
+# the access point and lease from the last successful connection
+NETWORK_FILE = 'network.txt'
+
+# how long a fast reconnect to the saved access point gets before falling back to a full connection; it normally
+# takes a second or two, so waiting longer only delays the fallback when the access point has gone
+FAST_CONNECT_TIMEOUT_SECS = 5
+
+# interval between connection status checks
+POLL_MS = 50
+
+# link status once associated with the access point, but before an address has been assigned
+STAT_LINK_NOIP = 2
+
+# statuses that mean the connection has failed and won't recover by waiting
+FAILED_STATUSES = (network.STAT_WRONG_PASSWORD, network.STAT_NO_AP_FOUND, network.STAT_CONNECT_FAIL)
+
+# milliseconds spent in each phase of the last connection
+timings = {}
+
+
+def load_last_network() -> tuple[bytes, tuple]:
+    """
+    Returns the BSSID and IP configuration saved from the last successful connection, or (None, None).
+    """
+    if not file_exists(NETWORK_FILE):
+        return None, None
+
+    with open(NETWORK_FILE) as f:
+        fields = f.read().strip().split(',')
+    if len(fields) != 5:
+        return None, None
+
+    return binascii.unhexlify(fields[0]), tuple(fields[1:])
+
+
+def save_last_network(bssid: bytes, ifconfig: tuple):
+    """
+    Saves the BSSID and IP configuration of the current connection, for a fast reconnect next time.
+    :param bssid: the access point BSSID
+    :param ifconfig: the IP configuration, as (ip, netmask, gateway, dns)
+    """
+    with open(NETWORK_FILE, 'w') as f:
+        f.write(','.join([binascii.hexlify(bssid).decode()] + list(ifconfig)))
+
+
+def forget_last_network():
     """
-    Connects to the configured network and returns the WLAN client and IP address.
+    Discards the saved access point and lease, so the next connection does a full scan and DHCP.
     """
-    print(f"connecting to {ssid}...")
+    if file_exists(NETWORK_FILE):
+        os.remove(NETWORK_FILE)
+
+
+def connected_bssid(wlan: network.WLAN, ssid: str) -> bytes:
+    """
+    Returns the BSSID of the access point the client is connected to. It is read from the interface where the port
+    reports it, as a scan keeps the radio on for seconds; otherwise it is found with a scan.
+    """
+    try:
+        bssid = wlan.config('bssid')
+    except (ValueError, OSError, TypeError):
+        bssid = None
+    return bssid or find_bssid(wlan, ssid)
+
+
+def find_bssid(wlan: network.WLAN, ssid: str) -> bytes:
+    """
+    Scans for the access point with the strongest signal for the given SSID, and returns its BSSID.
+    """
+    best = None
+    for found_ssid, bssid, channel, rssi, security, hidden in wlan.scan():
+        if found_ssid.decode() == ssid and (best is None or rssi > best[1]):
+            best = bssid, rssi
+    return best[0] if best else None
+
+
+async def wait_for_status(wlan: network.WLAN, min_status: int, deadline: int):
+    """
+    Waits until the connection reaches the given status, raising OSError on failure or once the deadline passes.
+    :param wlan: the WLAN client
+    :param min_status: the status to wait for
+    :param deadline: the utime.ticks_ms() value to give up at
+    """
+    while True:
+        status = wlan.status()
+        if status >= min_status:
+            return
+        if status in FAILED_STATUSES:
+            raise OSError(f"connection failed with status {status}")
+        if utime.ticks_diff(deadline, utime.ticks_ms()) <= 0:
+            raise OSError(f"timed out connecting; status {status}")
+        await asyncio.sleep_ms(POLL_MS)
+
+
+async def connect_to_network(ssid: str, password: str, timeout_secs: int = 20, static_ifconfig: tuple = None,
+                             reuse_lease: bool = False) -> tuple[network.WLAN, str]:
+    """
+    Connects to the configured network and returns the WLAN client and IP address. The radio associates in the
+    background, so other tasks run while this waits.
+
+    After the first successful connection the access point's BSSID is saved, so later connections go straight to it
+    instead of scanning. If static_ifconfig is given, or reuse_lease is set and a previous lease was saved, DHCP is
+    skipped. A fast reconnect gets a short deadline of its own; if it fails, the saved network is forgotten and a full
+    connection is tried. The saved network is only rewritten when it changes.
+
+    :param ssid: the network SSID
+    :param password: the network password
+    :param timeout_secs: how long to wait for the connection
+    :param static_ifconfig: optional static IP configuration, as (ip, netmask, gateway, dns)
+    :param reuse_lease: whether to reuse the address from the last DHCP lease
+    """
+    log.info("connecting to %s...", ssid)
 
     wlan = network.WLAN(network.STA_IF)
     wlan.active(True)
-    wlan.connect(ssid, password)
-    while not wlan.isconnected():
-        print('waiting for connection...')
-        utime.sleep(1)
+
+    saved = load_last_network()
+    bssid, last_ifconfig = saved
+    ifconfig = static_ifconfig or (last_ifconfig if reuse_lease else None)
+
+    with profiler.span('connect'):
+        try:
+            fast = bssid or (ifconfig and not static_ifconfig)
+            await _connect(wlan, ssid, password, min(timeout_secs, FAST_CONNECT_TIMEOUT_SECS) if fast else timeout_secs,
+                           bssid, ifconfig)
+        except OSError as e:
+            if not fast:
+                raise
+            log.warning("fast reconnect failed (%s); retrying with a full connection", e)
+            forget_last_network()
+            wlan.disconnect()
+            if ifconfig and not static_ifconfig:
+                # the reused lease didn't work, so go back to DHCP
+                wlan.ifconfig('dhcp')
+            bssid = None
+            await _connect(wlan, ssid, password, timeout_secs, None, static_ifconfig)
 
     ifconfig = wlan.ifconfig()
-    print(ifconfig)
+    log.info("associated in %d ms, got address in %d ms", timings['associate'], timings['dhcp'])
+
+    if bssid is None:
+        bssid = connected_bssid(wlan, ssid)
+    if bssid and (bssid, ifconfig) != saved:
+        # only written when it changes, to save a flash write on every connection
+        save_last_network(bssid, ifconfig)
 
     ip_addr = ifconfig[0]
-    print(f'connected on {ip_addr}')
+    log.info('connected on %s', ip_addr)
     return wlan, ip_addr
 
 
+async def _connect(wlan: network.WLAN, ssid: str, password: str, timeout_secs: int, bssid: bytes, ifconfig: tuple):
+    if ifconfig:
+        # a static configuration disables the DHCP client
+        wlan.ifconfig(ifconfig)
+
+    start = utime.ticks_ms()
+    deadline = utime.ticks_add(start, timeout_secs * 1000)
+    if bssid:
+        wlan.connect(ssid, password, bssid=bssid)
+    else:
+        wlan.connect(ssid, password)
+
+    await wait_for_status(wlan, STAT_LINK_NOIP, deadline)
+    associated = utime.ticks_ms()
+    timings['associate'] = utime.ticks_diff(associated, start)
+
+    await wait_for_status(wlan, network.STAT_GOT_IP, deadline)
+    timings['dhcp'] = utime.ticks_diff(utime.ticks_ms(), associated)
+
+
 def disconnect(wlan: network.WLAN):
     """
     Disconnects from the given WLAN client.
     """
-    print('disconnecting from network')
+    log.info('disconnecting from network')
     wlan.disconnect()
     wlan.active(False)
@@ -0,0 +1,131 @@
+import machine
+import struct
+import utime
+
+import log
+from utils import file_exists
+
+# sleep between refreshes with everything powered
+SLEEP_MODE_IDLE = 'idle'
+
+# machine.lightsleep between refreshes; RAM is retained and the main loop carries on
+SLEEP_MODE_LIGHT = 'light'
+
+# machine.deepsleep between refreshes; the device resets on wake and starts main() again
+SLEEP_MODE_DEEP = 'deep'
+
+STATE_FILE = 'state.bin'
+
+# state record: magic, last fetch time, weather dt of the cached weather, hash of the last flushed frame,
+# awake time of the last cycle in milliseconds
+STATE_MAGIC = b'PWS1'
+STATE_FORMAT = '<4sIIII'
+STATE_SIZE = struct.calcsize(STATE_FORMAT)
+
+
+class State:
+    """
+    The minimum state carried across a deep sleep.
+    """
+    last_fetch: int
+    last_dt: int
+    frame_hash: int
+    awake_ms: int
+
+    def __init__(self, last_fetch: int = 0, last_dt: int = 0, frame_hash: int = 0, awake_ms: int = 0):
+        self.last_fetch = last_fetch
+        self.last_dt = last_dt
+        self.frame_hash = frame_hash
+        self.awake_ms = awake_ms
+
+    def pack(self) -> bytes:
+        return struct.pack(STATE_FORMAT, STATE_MAGIC, self.last_fetch, self.last_dt, self.frame_hash, self.awake_ms)
+
+    @classmethod
+    def unpack(cls, data: bytes):
+        if len(data) < STATE_SIZE or data[0:4] != STATE_MAGIC:
+            return None
+        _, last_fetch, last_dt, frame_hash, awake_ms = struct.unpack_from(STATE_FORMAT, data)
+        return cls(last_fetch, last_dt, frame_hash, awake_ms)
+
+
+def _rtc_memory():
+    """
+    Returns the RTC memory accessor if the port has one, otherwise None. RTC memory survives deep sleep without a
+    flash write, but isn't available on every port (the RP2040 doesn't have it).
+    """
+    try:
+        return machine.RTC().memory
+    except AttributeError:
+        return None
+
+
+def load_state() -> State:
+    """
+    Loads the state saved before the last deep sleep, or returns an empty state if there is none.
+    """
+    rtc_memory = _rtc_memory()
+    state = None
+    if rtc_memory:
+        state = State.unpack(rtc_memory())
+    elif file_exists(STATE_FILE):
+        with open(STATE_FILE, 'rb') as f:
+            state = State.unpack(f.read())
+
+    if state is None:
+        log.info("no saved state")
+        return State()
+    return state
+
+
+def save_state(state: State):
+    """
+    Saves the state, preferring RTC memory over flash.
+    :param state: the state
+    """
+    rtc_memory = _rtc_memory()
+    if rtc_memory:
+        rtc_memory(state.pack())
+    else:
+        with open(STATE_FILE, 'wb') as f:
+            f.write(state.pack())
+
+
+def woke_from_deep_sleep(state: State) -> bool:
+    """
+    Returns whether this boot is a wake from deep sleep, rather than a power on or hard reset. Ports such as rp2 have
+    no DEEPSLEEP_RESET cause, as waking resets the chip like a power on, so there the saved state decides: it records
+    the awake time of a cycle only once the cycle has finished.
+    :param state: the state loaded at boot
+    """
+    deepsleep_reset = getattr(machine, 'DEEPSLEEP_RESET', None)
+    if deepsleep_reset is None:
+        return state.awake_ms > 0
+    return machine.reset_cause() == deepsleep_reset
+
+
+def report_awake(state: State, cycle_start: int):
+    """
+    Records and prints the time spent awake in this cycle.
+    :param state: the state
+    :param cycle_start: the utime.ticks_ms() value at the start of the cycle
+    """
+    state.awake_ms = utime.ticks_diff(utime.ticks_ms(), cycle_start)
+    # the measurement this module exists for, so it is shown at the default level
+    log.warning("awake for %d ms this cycle", state.awake_ms)
+
+
+def sleep(mode: str, seconds: int):
+    """
+    Sleeps for the given time in the given mode. In deep sleep mode this does not return, as the device resets on
+    wake.
+    :param mode: the sleep mode
+    :param seconds: the time to sleep
+    """
+    log.info("sleeping (%s) for %d seconds", mode, seconds)
+    if mode == SLEEP_MODE_DEEP:
+        machine.deepsleep(seconds * 1000)
+    elif mode == SLEEP_MODE_LIGHT:
+        machine.lightsleep(seconds * 1000)
+    else:
+        utime.sleep(seconds)
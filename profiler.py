@@ -0,0 +1,168 @@
+"""
+Opt-in profiling of where awake time and heap go in each refresh cycle.
+
+Spans are timed with utime.ticks_us() and aggregated by name; heap snapshots record gc.mem_free() at labelled
+points. At the end of each cycle the totals are logged and written as one record to a ring buffer file, so the
+most recent cycles can be read back from a unit in the field.
+
+Profiling is off until enable() is called. While it is off, span() returns a shared do-nothing context manager,
+so instrumented code doesn't allocate or read the clock.
+"""
+
+import utime
+
+import log
+
+try:
+    from gc import mem_free
+except ImportError:
+    mem_free = None
+
+from utils import file_exists
+
+PROFILE_FILE = 'profile.log'
+
+# the log holds this many cycles; each record is a fixed-size line, padded with spaces
+PROFILE_SLOTS = 32
+PROFILE_RECORD_SIZE = 256
+
+enabled = False
+
+# span totals for the current cycle, by name, as [count, total us, max us]
+_spans = {}
+
+# heap snapshots for the current cycle, as (label, free bytes)
+_heap = []
+
+# the number of the next cycle, and the log slot it will be written to
+_cycle = 0
+_slot = 0
+
+
+class _Span:
+    def __init__(self, name: str):
+        self.name = name
+        self.start = 0
+
+    def __enter__(self):
+        self.start = utime.ticks_us()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        record(self.name, utime.ticks_diff(utime.ticks_us(), self.start))
+        return False
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def enable():
+    """
+    Turns profiling on, and finds where the ring buffer file left off.
+    """
+    global enabled, _cycle, _slot
+    enabled = True
+
+    if not file_exists(PROFILE_FILE):
+        return
+    with open(PROFILE_FILE, 'rb') as f:
+        data = f.read()
+
+    # the slot after the record with the highest cycle number is the next to be written
+    for slot in range(min(len(data) // PROFILE_RECORD_SIZE, PROFILE_SLOTS)):
+        record_start = slot * PROFILE_RECORD_SIZE
+        number = data[record_start:data.find(b' ', record_start)]
+        if number.isdigit() and int(number) >= _cycle:
+            _cycle = int(number) + 1
+            _slot = (slot + 1) % PROFILE_SLOTS
+
+
+def span(name: str):
+    """
+    Returns a context manager that times the code inside it, adding to the named span's totals for this cycle.
+    :param name: the span name
+    """
+    if not enabled:
+        return _NULL_SPAN
+    return _Span(name)
+
+
+def record(name: str, us: int):
+    """
+    Adds a timing to the named span's totals for this cycle.
+    :param name: the span name
+    :param us: the time taken in microseconds
+    """
+    totals = _spans.get(name)
+    if totals is None:
+        _spans[name] = [1, us, us]
+    else:
+        totals[0] += 1
+        totals[1] += us
+        if us > totals[2]:
+            totals[2] = us
+
+
+def heap(label: str):
+    """
+    Records the free heap at this point in the cycle.
+    :param label: a label for the snapshot
+    """
+    if enabled and mem_free:
+        _heap.append((label, mem_free()))
+
+
+def summary(awake_ms: int) -> str:
+    """
+    Returns one line summarising the current cycle: the cycle number, the awake time, each span as name=total or
+    name=countxtotal/max, and each heap snapshot as label:free bytes. Times are in milliseconds.
+    :param awake_ms: the time spent awake in this cycle
+    """
+    parts = [f"{_cycle} awake={awake_ms}"]
+    for name, (count, total_us, max_us) in _spans.items():
+        if count == 1:
+            parts.append(f"{name}={total_us // 1000}")
+        else:
+            parts.append(f"{name}={count}x{total_us // 1000}/{max_us // 1000}")
+    for label, free in _heap:
+        parts.append(f"{label}:{free}")
+    return ' '.join(parts)
+
+
+def end_cycle(awake_ms: int):
+    """
+    Logs the summary of the current cycle, writes it to the ring buffer file, and starts a new cycle.
+    :param awake_ms: the time spent awake in this cycle
+    """
+    global _cycle, _slot
+    if not enabled:
+        return
+
+    line = summary(awake_ms)
+    # profiling is opt-in, so once enabled its summary is shown at the default level
+    log.warning("profile: %s", line)
+
+    record_bytes = bytearray(b' ' * PROFILE_RECORD_SIZE)
+    encoded = line.encode()[:PROFILE_RECORD_SIZE - 1]
+    record_bytes[:len(encoded)] = encoded
+    record_bytes[-1] = ord('\n')
+
+    if not file_exists(PROFILE_FILE):
+        with open(PROFILE_FILE, 'wb') as f:
+            pass
+    with open(PROFILE_FILE, 'r+b') as f:
+        f.seek(_slot * PROFILE_RECORD_SIZE)
+        f.write(record_bytes)
+
+    _cycle += 1
+    _slot = (_slot + 1) % PROFILE_SLOTS
+    _spans.clear()
+    _heap.clear()
@@ -1,10 +1,87 @@
 import framebuf
+import struct
+from array import array
+import uasyncio as asyncio
+from micropython import const
 
+import log
+import profiler
 from display import EPD_2in13_V3_Landscape
+from kernels import first_diff, last_diff, xor_into
+
+try:
+    from binascii import crc32
+except ImportError:
+    crc32 = None
+
+# lookup table for _crc32(), built on first use
+_crc_table = None
 
 # pixel width of a character
 CHAR_WIDTH = 8
 
+# pixel height of a character
+CHAR_HEIGHT = 8
+
+# set to 1 and recompile to log each flush
+_DEBUG = const(0)
+
+
+def frame_hash(buffer) -> int:
+    """
+    Returns a cheap hash of the given frame: its CRC-32, as the gateway computes it for the frames it sends.
+    :param buffer: the frame
+    """
+    if crc32:
+        return crc32(buffer)
+    return _crc32(buffer)
+
+
+def _crc32(buffer) -> int:
+    # the same CRC-32 as binascii.crc32, for ports built without it; a different hash would never match the gateway's
+    global _crc_table
+    if _crc_table is None:
+        _crc_table = array('I', [0] * 256)
+        for i in range(256):
+            c = i
+            for _ in range(8):
+                c = (c >> 1) ^ 0xedb88320 if c & 1 else c >> 1
+            _crc_table[i] = c
+
+    table = _crc_table
+    c = 0xffffffff
+    for b in buffer:
+        c = table[(c ^ b) & 0xff] ^ (c >> 8)
+    return c ^ 0xffffffff
+
+
+def find_changed_span(current, previous, start: int, end: int):
+    """
+    Returns the first and last indices in [start, end] at which the two buffers differ, or None if they are equal.
+    :param current: the current buffer
+    :param previous: the previous buffer
+    :param start: the first index to compare
+    :param end: the last index to compare
+    """
+    first = first_diff(current, previous, start, end)
+    if first > end:
+        return None
+    return first, last_diff(current, previous, first, end)
+
+
+def read_fully(stream, buffer):
+    """
+    Fills the buffer from the stream, raising OSError if the stream ends first.
+    :param stream: the stream
+    :param buffer: a memoryview to read into
+    """
+    pos = 0
+    while pos < len(buffer):
+        n = stream.readinto(buffer[pos:])
+        if not n:
+            raise OSError("stream ended after %d of %d bytes" % (pos, len(buffer)))
+        pos += n
+
 
 class DisplayController:
     """
@@ -13,98 +90,301 @@ class DisplayController:
 
     MAX_TEXT_WIDTH = 31
 
-    RENDER_FLAG_CLEAR = 1  # 2^0
-    RENDER_FLAG_APPEND_ONLY = 2  # 2^1
-    RENDER_FLAG_FLUSH = 4  # 2^2
-    RENDER_FLAG_THIN_PADDING = 8  # 2^3
-    RENDER_FLAG_BLANK = 16  # 2^4
-    RENDER_FLAG_NO_V_CURSOR = 32  # 2^5
+    def __init__(self, epd: EPD_2in13_V3_Landscape, full_refresh_every: int = 10, last_hash: int = 0):
+        """
+        :param epd: the e-ink display
+        :param full_refresh_every: every Nth flush is a full refresh, to clear ghosting left by partial refreshes
+        :param last_hash: the hash of the frame the panel is showing, if known, e.g. saved before a reset
+        """
+        self.epd = epd
+        self.full_refresh_every = full_refresh_every
 
-    last_text_y = 0
+        # the framebuffer is landscape, so its width is the panel's height
+        self.screen_width = epd.height
+        self.screen_height = epd.width
 
-    def __init__(self, epd: EPD_2in13_V3_Landscape):
-        self.epd = epd
+        self.dirty = []
+        self.last_frame = None
+
+        # the layout tree in the framebuffer, if any
+        self.shown = None
+        self.frame_hash = last_hash
+        self.updates_since_full = 0
+        self.partial_since_init = False
+        self.needs_init = True
+
+        # set when the controller has been reset, and its RAM no longer holds the frame on the panel
+        self.ram_stale = True
 
     def init(self):
         """
-        Initializes the display.
+        Marks the display for initialisation. The panel keeps showing its last frame while it sleeps, so it is only
+        initialized when something is next sent to it.
+        """
+        self.needs_init = True
+
+    def ensure_init(self):
+        """
+        Waits for any refresh in progress to finish, then initializes the display if it has been marked for
+        initialisation.
         """
+        self.epd.wait_busy()
+        if not self.needs_init:
+            return
         self.epd.init()
+        self.needs_init = False
+        self.ram_stale = True
+        self.partial_since_init = False
 
-    def get_last_text_y(self) -> int:
+    def blank(self):
         """
-        Returns the most recent Y value for rendered text
+        Fills the framebuffer with white. The panel isn't changed until the next flush.
         """
-        return self.last_text_y
+        with profiler.span('draw'):
+            self.epd.fill(0xff)
+            self.mark_dirty(0, 0, self.screen_width, self.screen_height)
+            self.shown = None
 
-    def display_text(self, render_flags: int, *lines: str):
+    def text(self, text: str, x: int, y: int):
         """
-        Displays the given lines of text on the e-ink display, optionally appending to the existing display.
+        Draws a line of text into the framebuffer.
+        :param text: the text
+        :param x: x coordinate
+        :param y: y coordinate
         """
-        self.display_text_at_coordinates(render_flags, 0, *lines)
+        with profiler.span('draw'):
+            self.epd.text(text, x, y, 0x00)
+            self.mark_dirty(x, y, len(text) * CHAR_WIDTH, CHAR_HEIGHT)
 
-    def display_text_at_coordinates(self, render_flags: int, x: int, *lines: str):
+    def hline(self, x: int, y: int, width: int):
         """
-        Displays the given lines of text on the e-ink display, optionally appending to the existing display.
+        Draws a horizontal line into the framebuffer.
+        :param x: x coordinate
+        :param y: y coordinate
+        :param width: the length of the line
         """
-        if render_flags & self.RENDER_FLAG_CLEAR:
-            self.epd.Clear()
-        if render_flags & self.RENDER_FLAG_BLANK:
-            self.epd.fill(0xff)
-            self.last_text_y = 0
-
-        line_stride: int
-        for line in lines:
-            if render_flags & self.RENDER_FLAG_NO_V_CURSOR:
-                line_stride = 0
-            elif render_flags & self.RENDER_FLAG_THIN_PADDING:
-                line_stride = 8
+        with profiler.span('draw'):
+            self.epd.hline(x, y, width, 0x00)
+            self.mark_dirty(x, y, width, 1)
+
+    def fill_rect(self, x: int, y: int, width: int, height: int, color: int):
+        """
+        Fills a rectangle of the framebuffer.
+        :param x: x coordinate
+        :param y: y coordinate
+        :param width: the width of the rectangle
+        :param height: the height of the rectangle
+        :param color: the fill colour
+        """
+        with profiler.span('draw'):
+            self.epd.fill_rect(x, y, width, height, color)
+            self.mark_dirty(x, y, width, height)
+
+    def clear(self):
+        """
+        Clears the panel to white with a full refresh.
+        """
+        self.ensure_init()
+        self.epd.Clear()
+        self.last_frame = bytearray(b'\xff' * len(self.epd.buffer))
+        self.ram_stale = True
+        self.shown = None
+        self.frame_hash = frame_hash(self.last_frame)
+
+    def read_frame(self, stream):
+        """
+        Reads a whole frame from the stream into the framebuffer. The frame is in the panel's RAM order, with the rows
+        of bytes reversed, so each row is read straight into its place in the framebuffer without an intermediate
+        copy. The panel isn't changed until the next flush.
+        :param stream: the stream, e.g. an HTTP response body
+        """
+        row_bytes = self.screen_width
+        rows = self.screen_height // 8
+        buffer = memoryview(self.epd.buffer)
+        for row in range(rows - 1, -1, -1):
+            read_fully(stream, buffer[row * row_bytes:(row + 1) * row_bytes])
+
+        self.mark_dirty(0, 0, self.screen_width, self.screen_height)
+        self.shown = None
+
+    def apply_delta(self, delta):
+        """
+        Applies a delta from the frame in the framebuffer to a new frame. The delta is a sequence of spans, each a
+        little-endian uint16 offset into the framebuffer and uint16 length, followed by that many bytes to XOR into
+        the framebuffer. Spans don't cross rows of bytes, so each marks just the part of its row that changed, and the
+        next flush only sends those windows.
+        :param delta: the delta
+        """
+        buffer = self.epd.buffer
+        row_bytes = self.screen_width
+        src = memoryview(delta)
+        pos = 0
+        while pos < len(delta):
+            offset, length = struct.unpack_from('<HH', delta, pos)
+            pos += 4
+            # the compiled kernels don't check bounds
+            if offset + length > len(buffer) or pos + length > len(delta):
+                raise ValueError("delta span out of range")
+            xor_into(buffer, offset, src[pos:pos + length], length)
+            pos += length
+            self.mark_dirty(offset % row_bytes, offset // row_bytes * 8, length, 8)
+
+        self.shown = None
+
+    def mark_dirty(self, x: int, y: int, width: int, height: int):
+        """
+        Records that the given region of the framebuffer has been drawn to since the last flush.
+        :param x: x coordinate
+        :param y: y coordinate
+        :param width: the width of the region
+        :param height: the height of the region
+        """
+        x0 = max(x, 0)
+        y0 = max(y, 0)
+        x1 = min(x + width, self.screen_width) - 1
+        y1 = min(y + height, self.screen_height) - 1
+        if x0 <= x1 and y0 <= y1:
+            self.dirty.append((x0, y0, x1, y1))
+
+    def changed_windows(self) -> list[tuple[int, int, int, int]]:
+        """
+        Compares the dirty regions of the framebuffer against the last flushed frame, and returns the windows that
+        changed as (x0, y0, x1, y1) inclusive coordinates, aligned to 8 pixel rows.
+        """
+        rows = self.screen_height // 8
+
+        # union of the dirty regions touching each row of bytes
+        row_spans = [None] * rows
+        for x0, y0, x1, y1 in self.dirty:
+            for row in range(y0 // 8, y1 // 8 + 1):
+                span = row_spans[row]
+                row_spans[row] = (x0, x1) if span is None else (min(span[0], x0), max(span[1], x1))
+
+        windows = []
+        current = self.epd.buffer
+        window = None
+        for row in range(rows):
+            changed = None
+            if row_spans[row] is not None:
+                offset = row * self.screen_width
+                changed = find_changed_span(current, self.last_frame,
+                                            offset + row_spans[row][0], offset + row_spans[row][1])
+
+            if changed is None:
+                if window is not None:
+                    windows.append(window)
+                    window = None
+                continue
+
+            x0 = changed[0] - offset
+            x1 = changed[1] - offset
+            if window is None:
+                window = (x0, row * 8, x1, row * 8 + 7)
             else:
-                line_stride = 10
+                window = (min(window[0], x0), window[1], max(window[2], x1), row * 8 + 7)
 
-            self.last_text_y += line_stride
-            self.epd.text(line, x, self.last_text_y, 0x00)
+        if window is not None:
+            windows.append(window)
+        return windows
 
-        if render_flags & self.RENDER_FLAG_FLUSH:
-            self.epd.display(self.epd.buffer)
+    def flush_display(self, wait: bool = True):
+        """
+        Flushes the display buffer to the display. Only the windows that changed since the last flush are sent,
+        using a partial refresh, unless a full refresh is due.
+        :param wait: whether to wait for the refresh to finish; if not, call wait_until_idle() before drawing again
+        """
+        with profiler.span('flush'):
+            self._flush(wait)
+
+    def _flush(self, wait: bool):
+        buffer = self.epd.buffer
+
+        # the panel keeps its image through a reset, so the frame may already be showing even if nothing has been
+        # flushed since boot
+        new_hash = frame_hash(buffer)
+        if new_hash == self.frame_hash:
+            if _DEBUG:
+                log.debug("display unchanged; skipping refresh")
+            if self.last_frame is None:
+                self.last_frame = bytearray(buffer)
+            self.dirty = []
+            return
+
+        if self.last_frame is None or self.updates_since_full + 1 >= self.full_refresh_every:
+            if _DEBUG:
+                log.debug("full refresh")
+            if self.partial_since_init:
+                # restore the full refresh waveform
+                self.needs_init = True
+            self.ensure_init()
+            self.epd.Display_Base(buffer, wait)
+            self.updates_since_full = 0
 
-    def flush_display(self):
+        else:
+            windows = self.changed_windows()
+            if not windows:
+                if _DEBUG:
+                    log.debug("display unchanged; skipping refresh")
+                self.dirty = []
+                return
+
+            if _DEBUG:
+                log.debug("partial refresh of %d window(s)", len(windows))
+            self.ensure_init()
+            if self.ram_stale:
+                self.epd.write_base(self.last_frame)
+            self.epd.display_Partial_windows(buffer, windows, wait)
+            self.partial_since_init = True
+            self.updates_since_full += 1
+
+        if self.last_frame is None:
+            self.last_frame = bytearray(buffer)
+        else:
+            self.last_frame[:] = buffer
+        self.dirty = []
+        self.ram_stale = False
+        self.frame_hash = new_hash
+
+    def is_busy(self) -> bool:
         """
-        Flushes the display buffer to the display.
+        Returns whether the panel is still refreshing.
         """
-        self.epd.display(self.epd.buffer)
+        return self.epd.is_busy()
 
-    def add_vertical_space(self, pixels: int):
+    def wait_until_idle(self):
         """
-        Adds the given number of pixels of vertical space to the display.
-        :param pixels: the number of pixels
+        Waits for the panel to finish refreshing.
         """
-        self.last_text_y += pixels
+        self.epd.wait_busy()
 
-    def render_horizontal_separator(self):
+    async def wait_until_idle_async(self):
         """
-        Renders a horizontal separator on the display.
+        Waits for the panel to finish refreshing, letting other tasks run meanwhile.
         """
-        self.add_vertical_space(2)
-        self.epd.hline(1, self.get_last_text_y() + CHAR_WIDTH, 248, 0x00)
-        self.add_vertical_space(2)
+        while self.is_busy():
+            await asyncio.sleep_ms(10)
+        self.epd.wait_busy()
 
     def deep_sleep(self):
         """
-        Puts the display into deep sleep mode, pausing first.
+        Puts the display into deep sleep mode, once any refresh has finished. Does nothing if the display wasn't
+        woken.
         """
-        self.epd.delay_ms(2000)
+        if self.needs_init:
+            return
+        self.needs_init = True
+        self.epd.wait_busy()
         self.epd.sleep()
 
-    def blit(self, fb: framebuf.FrameBuffer, x: int, y: int):
+    def blit(self, fb: framebuf.FrameBuffer, x: int, y: int, width: int, height: int):
         """
         Blits the given framebuffer to the display at the given coordinates.
         :param fb: the framebuffer
         :param x: x coordinate
         :param y: y coordinate
+        :param width: the width of the framebuffer
+        :param height: the height of the framebuffer
         """
-        self.epd.blit(fb, x, y)
-
-    def display_right(self, flags: int, text: str):
-        padding = (self.MAX_TEXT_WIDTH - len(text)) * CHAR_WIDTH
-        self.display_text_at_coordinates(flags | self.RENDER_FLAG_NO_V_CURSOR, padding, text)
+        with profiler.span('draw'):
+            self.epd.blit(fb, x, y)
+            self.mark_dirty(x, y, width, height)
@@ -0,0 +1,128 @@
+"""Compare app startup on a MicroPython device from source, .mpy and frozen modules.
+
+Uploads the app as source to /bench/py and as compiled modules (from
+scripts/build.py) to /bench/mpy. Then, after a soft reset for each run, it
+times importing the app, which loads every module, and records the heap that
+loading it used. The frozen variant imports the app with only the firmware's
+frozen modules on the path, so it needs firmware built with build/manifest.py;
+it is skipped if the app isn't frozen.
+
+Usage:
+    bench_boot PORT [options]
+
+Options:
+    -n --runs=N             Runs per variant [default: 5].
+    -b --build=PATH         Build directory [default: build].
+    --no-upload             Don't upload; use what's already in /bench.
+"""
+
+import glob
+import os
+import statistics
+import sys
+from typing import List, Optional, Tuple
+
+from docopt import docopt
+from ampy.pyboard import Pyboard, PyboardError
+from ampy.files import Files
+
+from build import ROOT_DIR, MAIN_MODULE, APP_MODULE
+from microupload import make_dirs
+
+BENCH_DIR = 'bench'
+
+# the part of sys.path holding frozen modules
+FROZEN_PATH = '.frozen'
+
+# imports the app with the given path, and prints the import time in microseconds, the heap allocated while
+# importing, and the heap still in use afterwards, in bytes
+BENCH_SCRIPT = """
+import gc, sys, utime
+sys.path[:] = {path!r}
+gc.collect()
+free = gc.mem_free()
+start = utime.ticks_us()
+import {module}
+elapsed = utime.ticks_diff(utime.ticks_us(), start)
+used = free - gc.mem_free()
+gc.collect()
+print(elapsed, used, free - gc.mem_free())
+"""
+
+
+def main(args: List[str]) -> None:
+    opts = docopt(__doc__, argv=args)
+    runs = int(opts['--runs'])
+    mpy_dir = os.path.join(opts['--build'], 'mpy')
+
+    port = opts['PORT']
+    print('Connecting to {}'.format(port), file=sys.stderr)
+    board = Pyboard(port)
+    files = Files(board)
+
+    if not opts['--no-upload']:
+        sources = {
+            (APP_MODULE if os.path.basename(path) == MAIN_MODULE else os.path.basename(path)[:-3]) + '.py': path
+            for path in glob.glob(os.path.join(ROOT_DIR, '*.py'))
+        }
+        compiled = {os.path.basename(path): path for path in glob.glob(os.path.join(mpy_dir, '*.mpy'))}
+        if not compiled:
+            print('No compiled modules in {}; run scripts/build.py first'.format(mpy_dir), file=sys.stderr)
+            sys.exit(1)
+        upload(files, BENCH_DIR + '/py', sources)
+        upload(files, BENCH_DIR + '/mpy', compiled)
+
+    # the firmware's own frozen modules, such as asyncio, are needed by every variant
+    variants = [
+        ('source', ['/' + BENCH_DIR + '/py', FROZEN_PATH]),
+        ('mpy', ['/' + BENCH_DIR + '/mpy', FROZEN_PATH]),
+        ('frozen', [FROZEN_PATH]),
+    ]
+    print('{:8} {:>12} {:>12} {:>12}'.format('variant', 'import ms', 'heap peak', 'heap kept'))
+    for name, path in variants:
+        results = []
+        for _ in range(runs):
+            result = bench(board, path)
+            if result is None:
+                break
+            results.append(result)
+
+        if not results:
+            print('{:8} {:>12}'.format(name, 'n/a'))
+            continue
+        print('{:8} {:>12.1f} {:>12} {:>12}'.format(
+            name,
+            statistics.median(r[0] for r in results) / 1000,
+            int(statistics.median(r[1] for r in results)),
+            int(statistics.median(r[2] for r in results)),
+        ))
+
+
+def upload(files: Files, remote_dir: str, local_files: dict) -> None:
+    """Upload the given files, by remote name, to a directory on the device."""
+    make_dirs(files, remote_dir)
+    for name, local_path in sorted(local_files.items()):
+        with open(local_path, 'rb') as fd:
+            files.put(remote_dir + '/' + name, fd.read())
+
+
+def bench(board: Pyboard, path: List[str]) -> Optional[Tuple[int, int, int]]:
+    """Import the app after a soft reset, and return (import us, heap used, heap kept), or None if it can't be
+    imported from the given path."""
+    # entering the raw REPL soft resets the board, so nothing is left imported from the last run
+    board.enter_raw_repl()
+    try:
+        output = board.exec_(BENCH_SCRIPT.format(path=path, module=APP_MODULE))
+    except PyboardError as e:
+        if 'ImportError' in str(e):
+            return None
+        raise
+    finally:
+        board.exit_raw_repl()
+
+    elapsed, used, kept = output.split()
+    return int(elapsed), int(used), int(kept)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,119 @@
+"""Measure the throughput of each variant of the framebuffer kernels in kernels.py.
+
+Times every kernel of every variant that loads over a frame-sized buffer, and
+reports bytes per second. On a MicroPython device, the viper, native and pure
+Python variants are compared; the kernel modules are uploaded as source to
+/bench/kernels first, so the device compiles them itself. Without a port, the
+kernels are timed here under CPython, where only the pure Python variant loads.
+
+Usage:
+    bench_kernels [PORT] [options]
+
+Options:
+    -n --runs=N             Calls of each kernel [default: 20].
+    -s --size=BYTES         Bytes each call walks; a frame is 4000 [default: 4000].
+    --no-upload             Don't upload; use what's already in /bench.
+"""
+
+import contextlib
+import io
+import os
+import sys
+from typing import List
+
+from docopt import docopt
+from ampy.files import Files
+
+from build import ROOT_DIR
+from devices import open_board
+from microupload import make_dirs
+
+BENCH_DIR = 'bench/kernels'
+
+KERNEL_MODULES = ('kernels.py', 'kernels_native.py')
+
+# calls each kernel of each variant over equal buffers, so the comparisons walk the whole buffer, once to warm up
+# then timed, and prints the variant, the kernel and the elapsed microseconds
+BENCH_SCRIPT = """
+import sys, utime
+sys.path.insert(0, {path!r})
+import kernels
+size = {size}
+a = bytearray(size)
+b = bytearray(size)
+src = memoryview(bytearray(size))
+for name, (first_diff, last_diff, xor_into) in kernels.VARIANTS:
+    for kernel, call in (
+        ('first_diff', lambda: first_diff(a, b, 0, size - 1)),
+        ('last_diff', lambda: last_diff(a, b, 0, size - 1)),
+        ('xor_into', lambda: xor_into(a, 0, src, size)),
+    ):
+        call()
+        start = utime.ticks_us()
+        for _ in range({runs}):
+            call()
+        print(name, kernel, utime.ticks_diff(utime.ticks_us(), start))
+print('chosen', kernels.VARIANT, 0)
+"""
+
+
+def main(args: List[str]) -> None:
+    opts = docopt(__doc__, argv=args)
+    runs = int(opts['--runs'])
+    size = int(opts['--size'])
+
+    port = opts['PORT']
+    if port:
+        print('Connecting to {}'.format(port), file=sys.stderr)
+        output = bench_on_device(port, size, runs, not opts['--no-upload'])
+    else:
+        output = bench_here(size, runs)
+
+    chosen = None
+    print('{:8} {:12} {:>14}'.format('variant', 'kernel', 'bytes/s'))
+    for line in output.splitlines():
+        if not line.strip():
+            continue
+        name, kernel, elapsed_us = line.split()
+        if name == 'chosen':
+            chosen = kernel
+            continue
+        rate = size * runs * 1_000_000 / max(int(elapsed_us), 1)
+        print('{:8} {:12} {:>14,.0f}'.format(name, kernel, rate))
+    print('chosen at import: {}'.format(chosen))
+
+
+def bench_on_device(port: str, size: int, runs: int, upload: bool) -> str:
+    """Run the benchmark on a device, uploading the kernel modules first if asked, and return its output."""
+    board = open_board(port)
+    try:
+        if upload:
+            files = Files(board)
+            make_dirs(files, BENCH_DIR)
+            for name in KERNEL_MODULES:
+                with open(os.path.join(ROOT_DIR, name), 'rb') as fd:
+                    files.put(BENCH_DIR + '/' + name, fd.read())
+
+        # entering the raw REPL soft resets the board, so the freshly uploaded modules are imported
+        board.enter_raw_repl()
+        try:
+            output = board.exec_(BENCH_SCRIPT.format(path='/' + BENCH_DIR, size=size, runs=runs))
+        finally:
+            board.exit_raw_repl()
+    finally:
+        board.close()
+    return output.decode()
+
+
+def bench_here(size: int, runs: int) -> str:
+    """Run the benchmark in this process, with the host stand-ins for the MicroPython modules, and return its
+    output."""
+    sys.path[:0] = [ROOT_DIR, os.path.join(ROOT_DIR, 'host')]
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        exec(BENCH_SCRIPT.format(path=ROOT_DIR, size=size, runs=runs), {})
+    return output.getvalue()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
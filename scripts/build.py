@@ -0,0 +1,109 @@
+"""Precompile the app to MicroPython bytecode with mpy-cross.
+
+Every module in the project root is compiled to a .mpy file in build/mpy, so the
+board doesn't have to compile the source on each boot. MicroPython only runs
+main.py from source, so main.py is compiled as app.mpy and a two line main.py
+that imports it is written alongside. The images.bin bundle and the config.txt
+file, if it exists, are copied too, so build/mpy holds everything the board
+needs.
+
+The sources are also staged in build/frozen with a manifest.py, for freezing the
+app into a custom firmware image (see the README).
+
+Usage:
+    build [options]
+
+Options:
+    --mpy-cross=PATH        The mpy-cross executable [default: mpy-cross].
+    --arch=ARCH             Native code architecture [default: armv6m].
+    -O --optimize=LEVEL     Bytecode optimisation level [default: 0].
+    -o --output=PATH        Output directory [default: build].
+    -v --verbose            Verbose output.
+"""
+
+import glob
+import os
+import shutil
+import subprocess
+import sys
+from typing import List
+
+from docopt import docopt
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the entry point, which MicroPython only runs as source
+MAIN_MODULE = 'main.py'
+
+# the name main.py is compiled under
+APP_MODULE = 'app'
+
+# files the app reads at runtime, copied alongside the modules
+DATA_FILES = ('images.bin', 'config.txt')
+
+MAIN_STUB = f"""import {APP_MODULE}
+{APP_MODULE}.main()
+"""
+
+MANIFEST_HEADER = """# Freezes the app into a custom firmware image. Pass this file to the firmware build, e.g.
+#   make -C ports/rp2 BOARD=RPI_PICO_W FROZEN_MANIFEST={manifest}
+include("$(PORT_DIR)/boards/manifest.py")
+
+"""
+
+
+def main(args: List[str]) -> None:
+    opts = docopt(__doc__, argv=args)
+    verbose = opts['--verbose']
+    output = os.path.abspath(opts['--output'])
+
+    mpy_dir = os.path.join(output, 'mpy')
+    frozen_dir = os.path.join(output, 'frozen')
+    for path in (mpy_dir, frozen_dir):
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+
+    sources = sorted(glob.glob(os.path.join(ROOT_DIR, '*.py')))
+    modules = []
+    for source in sources:
+        name = os.path.basename(source)
+        module = APP_MODULE if name == MAIN_MODULE else name[:-3]
+        modules.append(module)
+
+        target = os.path.join(mpy_dir, module + '.mpy')
+        compile_module(opts['--mpy-cross'], source, target, module + '.py', opts['--arch'], opts['--optimize'])
+        shutil.copyfile(source, os.path.join(frozen_dir, module + '.py'))
+        if verbose:
+            print('{} -> {} ({} -> {} bytes)'.format(name, os.path.relpath(target, ROOT_DIR),
+                                                     os.path.getsize(source), os.path.getsize(target)),
+                  file=sys.stderr)
+
+    with open(os.path.join(mpy_dir, MAIN_MODULE), 'w') as f:
+        f.write(MAIN_STUB)
+
+    for data_file in DATA_FILES:
+        path = os.path.join(ROOT_DIR, data_file)
+        if os.path.exists(path):
+            shutil.copyfile(path, os.path.join(mpy_dir, data_file))
+
+    manifest = os.path.join(output, 'manifest.py')
+    with open(manifest, 'w') as f:
+        f.write(MANIFEST_HEADER.format(manifest=manifest))
+        for module in modules:
+            f.write('module("{}.py", base_path="{}")\n'.format(module, frozen_dir))
+
+    print('Compiled {} modules to {}'.format(len(modules), os.path.relpath(mpy_dir, os.getcwd())), file=sys.stderr)
+    print('Wrote frozen manifest to {}'.format(os.path.relpath(manifest, os.getcwd())), file=sys.stderr)
+
+
+def compile_module(mpy_cross: str, source: str, target: str, source_name: str, arch: str, optimize: str) -> None:
+    """Compile one module with mpy-cross, exiting if it fails."""
+    cmd = [mpy_cross, '-march=' + arch, '-O' + optimize, '-s', source_name, '-o', target, source]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        print('Failed to compile {}:\n{}'.format(source, result.stderr), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,163 @@
+"""Run a deploy task on several MicroPython devices at once.
+
+Ports are given as a comma-separated list, each of which may be a glob such as
+/dev/ttyACM*. A port of the form fake:DIR connects to a stand-in board whose
+filesystem is the directory DIR on this machine (see host/fake_pyboard.py), for
+trying the scripts without hardware; set FAKE_PYBOARD_DELAY to a number of
+seconds to simulate the serial round trip of each command.
+"""
+
+import glob
+import os
+import sys
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Sequence, TypeVar
+
+from ampy.pyboard import Pyboard, PyboardError
+from ampy.files import Files
+
+FAKE_PREFIX = 'fake:'
+
+HOST_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'host')
+
+T = TypeVar('T')
+
+_output_lock = threading.Lock()
+
+
+class Device:
+    """A connected board, and the progress output for it."""
+
+    def __init__(self, port: str, prefixed: bool):
+        """
+        :param port: the port the board is connected to
+        :param prefixed: whether to prefix output with the port, and report
+                         progress a line at a time, because several devices
+                         are being written to at once
+        """
+        self.port = port
+        self.prefixed = prefixed
+        self.board = None
+        self.files = None
+
+    def connect(self) -> None:
+        """Connect to the board."""
+        self.board = open_board(self.port)
+        self.files = Files(self.board)
+
+    def log(self, msg: str) -> None:
+        """Print a message about this device."""
+        with _output_lock:
+            if self.prefixed:
+                # a leading newline only ends a single device's progress line
+                msg = '[{}] {}'.format(self.port, msg.lstrip('\n'))
+            print(msg, file=sys.stderr, flush=True)
+
+    def progress(self, msg: str, xs: Sequence[T]) -> Iterable[T]:
+        """Show progress while iterating over a sequence."""
+        size = len(xs)
+        if self.prefixed:
+            for i, x in enumerate(xs, 1):
+                yield x
+                self.log('{}: {}% ({}/{})'.format(msg, int(i * 100 / size), i, size))
+            return
+
+        sys.stderr.write('\r{}: 0% (0/{})'.format(msg, size))
+        sys.stderr.flush()
+        for i, x in enumerate(xs, 1):
+            yield x
+            s = '{0}: {1}% ({2}/{3})'.format(msg, int(i * 100 / size), i, size)
+            sys.stderr.write('\r' + s)
+            sys.stderr.flush()
+        sys.stderr.write('\n')
+        sys.stderr.flush()
+
+
+def expand_ports(spec: str) -> List[str]:
+    """Expand a comma-separated list of ports and globs into the ports it
+    names, exiting if a glob matches nothing."""
+    ports = []
+    for pattern in spec.split(','):
+        if not pattern:
+            continue
+        prefix = FAKE_PREFIX if pattern.startswith(FAKE_PREFIX) else ''
+        path = pattern[len(prefix):]
+        if not glob.has_magic(path):
+            ports.append(pattern)
+            continue
+        matches = [prefix + match for match in sorted(glob.glob(path))]
+        if not matches:
+            print('No devices match {}'.format(pattern), file=sys.stderr)
+            sys.exit(1)
+        ports += matches
+
+    # the same device twice would be written to concurrently
+    return list(dict.fromkeys(ports))
+
+
+def open_board(port: str) -> Pyboard:
+    """Connect to the board on the given port."""
+    if port.startswith(FAKE_PREFIX):
+        if HOST_DIR not in sys.path:
+            sys.path.append(HOST_DIR)
+        from fake_pyboard import FakePyboard
+        return FakePyboard(port[len(FAKE_PREFIX):],
+                           float(os.environ.get('FAKE_PYBOARD_DELAY', 0)))
+    return Pyboard(port)
+
+
+def run_on_devices(ports: List[str], task: Callable[[Device], None],
+                   jobs: int) -> None:
+    """Connect to each port and run the task on it, on up to the given number
+    of devices at once. Failures on one device don't stop the others; they are
+    summarised at the end, and the script exits with an error if there were
+    any."""
+    prefixed = len(ports) > 1
+    failures: Dict[str, str] = {}
+
+    # PyboardError doesn't derive from Exception, so is caught separately
+    def run(port: str) -> None:
+        device = Device(port, prefixed)
+        device.log('Connecting to {}'.format(port))
+        try:
+            device.connect()
+        except (Exception, PyboardError) as e:
+            failures[port] = 'connect failed: {}'.format(describe(e))
+            device.log('Failed: {}'.format(failures[port]))
+            return
+        try:
+            task(device)
+        except (Exception, PyboardError) as e:
+            failures[port] = describe(e)
+            device.log('Failed: {}'.format(failures[port]))
+        finally:
+            device.board.close()
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        # list() so exceptions escaping run() aren't lost
+        list(executor.map(run, ports))
+
+    if not failures:
+        if prefixed:
+            print('Done on {} devices'.format(len(ports)), file=sys.stderr)
+        return
+
+    print('Failed on {} of {} devices:'.format(len(failures), len(ports)), file=sys.stderr)
+    for port in ports:
+        if port in failures:
+            print('  {}: {}'.format(port, failures[port]), file=sys.stderr)
+    sys.exit(1)
+
+
+def describe(e: BaseException) -> str:
+    """A one line description of an exception, including the device's error
+    for a failed command."""
+    lines = [line for line in str(e).splitlines() if line.strip()]
+    if len(e.args) > 2 and isinstance(e.args[2], bytes):
+        # a PyboardError, whose last argument is the device's traceback
+        lines = e.args[2].decode(errors='replace').strip().splitlines()
+    if not lines:
+        return ''.join(traceback.format_exception_only(type(e), e)).strip()
+    return lines[-1].strip()
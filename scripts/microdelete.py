@@ -15,28 +15,36 @@
 
 """Delete all files and directories from a MicroPython device.
 
+The delete runs on the device as one script, which walks the filesystem depth
+first, so the whole wipe is a single round trip. Paths given with --keep are
+left in place, along with the directories holding them.
+
+PORT may be a comma-separated list of ports, each of which may be a glob such
+as /dev/ttyACM*, to clear several devices at once; up to --jobs devices are
+cleared concurrently. See devices.py for testing against a fake board.
+
 Usage:
     microdelete PORT [options]
 
 Options:
+    -k --keep=PATHS         Comma-separated paths to keep, e.g. config.txt,cache/
+    -j --jobs=N             Devices to clear at once [default: 4].
     -v --verbose            Verbose output.
 """
 
 import time
 import sys
-import os
-from contextlib import suppress
-from typing import List, Iterable, TypeVar, Sequence, Set
+from typing import List, Set
 
 from docopt import docopt
 from ampy.pyboard import Pyboard
-from ampy.files import Files, DirectoryExistsError
+
+from devices import Device, expand_ports, run_on_devices
 
 
 __all__ = []
 
 verbose = False
-T = TypeVar('T')
 
 
 def main(args: List[str]) -> None:
@@ -44,26 +52,82 @@ def main(args: List[str]) -> None:
     opts = docopt(__doc__, argv=args)
     verbose = opts['--verbose']
 
-    port = opts['PORT']
-    print('Connecting to {}'.format(port), file=sys.stderr)
-    board = Pyboard(port)
-    files = Files(board)
-
-    wait_for_board()
-
-    while True:
-        remote_files = files.ls(long_format=False, recursive=True)
-        if len(remote_files) == 1:
-            break
+    keep = to_keep_paths(opts['--keep'] or '')
+
+    def delete_all(device: Device) -> None:
+        wait_for_board()
+        wipe(device, keep)
+        device.log('Soft reboot')
+        soft_reset(device.board)
+
+    run_on_devices(expand_ports(opts['PORT']), delete_all, int(opts['--jobs']))
+
+
+# deletes everything depth first except the kept paths, printing each path
+# deleted if verbose, then the number of files and directories deleted, paths
+# kept, paths that couldn't be deleted, and the milliseconds it took
+WIPE_SCRIPT = """
+import os, utime
+keep = {keep!r}
+verbose = {verbose!r}
+counts = [0, 0, 0, 0]
+def wipe(d):
+    empty = True
+    for entry in list(os.ilistdir(d)):
+        p = (d if d != '/' else '') + '/' + entry[0]
+        if p in keep:
+            counts[2] += 1
+            empty = False
+            continue
+        try:
+            if entry[1] == 0x4000:
+                if not wipe(p):
+                    empty = False
+                    continue
+                os.rmdir(p)
+                counts[1] += 1
+            else:
+                os.remove(p)
+                counts[0] += 1
+            if verbose:
+                print(p)
+        except OSError:
+            counts[3] += 1
+            empty = False
+    return empty
+start = utime.ticks_ms()
+wipe('/')
+print(*counts, utime.ticks_diff(utime.ticks_ms(), start))
+"""
 
-        for f in remote_files:
-            if f == '/':
-                continue
-            print(f"Deleting {f}")
-            files.rm(f)
 
-    print('Soft reboot', file=sys.stderr, flush=True)
-    soft_reset(board)
+def to_keep_paths(spec: str) -> Set[str]:
+    """Convert a comma-separated list of paths to keep to absolute device
+    paths."""
+    return {'/' + path.strip('/') for path in spec.split(',') if path.strip('/')}
+
+
+def wipe(device: Device, keep: Set[str]) -> None:
+    """Delete everything on the device except the kept paths, with one
+    command."""
+    start = time.monotonic()
+    device.board.enter_raw_repl()
+    try:
+        output = device.board.exec_(WIPE_SCRIPT.format(keep=keep, verbose=verbose))
+    finally:
+        device.board.exit_raw_repl()
+    elapsed = time.monotonic() - start
+
+    lines = output.decode().strip().splitlines()
+    for path in lines[:-1]:
+        device.log('Deleted {}'.format(path))
+    files, dirs, kept, failed, device_ms = (int(n) for n in lines[-1].split())
+
+    device.log('Deleted {} files and {} directories in {} ms on the device '
+               '({:.2f} s in total){}'.format(files, dirs, device_ms, elapsed,
+                                              '; kept {} paths'.format(kept) if kept else ''))
+    if failed:
+        raise RuntimeError('{} paths could not be deleted'.format(failed))
 
 
 def soft_reset(board: Pyboard) -> None:
@@ -15,28 +15,46 @@
 
 """Upload files and directories onto a MicroPython device.
 
+When a compiled .mpy module is uploaded, the source .py of the same name is
+removed from the device, as MicroPython would import the source in preference.
+
+With --sync, the SHA-256 of every local file is compared with the file on the
+device, fetched for all files in one round trip, and only files that differ are
+uploaded. Files are streamed to the device in chunks, and everything happens in
+a single raw REPL session.
+
+PORT may be a comma-separated list of ports, each of which may be a glob such
+as /dev/ttyACM*, to deploy to several devices at once; up to --jobs devices are
+written to concurrently. See devices.py for testing against a fake board.
+
 Usage:
     microupload PORT PATH... [options]
 
 Options:
     -C --chdir=PATH         Change current directory to path.
+    -j --jobs=N             Devices to deploy to at once [default: 4].
+    -s --sync               Only upload files that differ from the device.
+    --chunk-size=BYTES      Chunk size for streamed writes [default: 512].
     -v --verbose            Verbose output.
 """
 
+import ast
+import hashlib
 import time
 import sys
 import os
 from contextlib import suppress
-from typing import List, Iterable, TypeVar, Sequence, Set
+from typing import Dict, List, Iterable, Optional, Set
 
 from docopt import docopt
 from ampy.pyboard import Pyboard
 from ampy.files import Files, DirectoryExistsError
 
+from devices import Device, expand_ports, run_on_devices
+
 __all__ = []
 
 verbose = False
-T = TypeVar('T')
 
 
 def main(args: List[str]) -> None:
@@ -49,39 +67,154 @@ def main(args: List[str]) -> None:
     if chdir:
         os.chdir(chdir)
 
-    port = opts['PORT']
-    print('Connecting to {}'.format(port), file=sys.stderr)
-    board = Pyboard(port)
-    files = Files(board)
-
-    created_cache = set()
+    ports = expand_ports(opts['PORT'])
     to_upload: List[str] = []
 
     for root in paths:
         rel_root = os.path.relpath(root, os.getcwd())
 
-        wait_for_board()
-
         if os.path.isdir(root):
             to_upload += [os.path.join(rel_root, x)
                           for x in list_files(root)]
         else:
             to_upload += [rel_root]
 
-    for path in progress('Uploading files', to_upload):
+    def deploy(device: Device) -> None:
+        wait_for_board()
+        if opts['--sync']:
+            sync(device, to_upload, int(opts['--chunk-size']))
+        else:
+            upload(device, to_upload)
+        device.log('Soft reboot')
+        soft_reset(device.board)
+
+    run_on_devices(ports, deploy, int(opts['--jobs']))
+
+
+def upload(device: Device, paths: List[str]) -> None:
+    """Upload all the given files."""
+    created_cache = set()
+    for path in device.progress('Uploading files', paths):
         local_path = os.path.abspath(path)
-        remote_path = os.path.normpath(path).replace(os.path.sep, '/')
+        remote_path = to_remote_path(path)
         if verbose:
-            print('\n{} -> {}'.format(local_path, remote_path),
-                  file=sys.stderr, flush=True)
+            device.log('\n{} -> {}'.format(local_path, remote_path))
         remote_dir = os.path.dirname(path)
         if remote_dir:
-            make_dirs(files, remote_dir, created_cache)
+            make_dirs(device.files, remote_dir, created_cache)
         with open(local_path, 'rb') as fd:
-            files.put(remote_path, fd.read())
+            device.files.put(remote_path, fd.read())
+        if remote_path.endswith('.mpy'):
+            remove_source(device, remote_path[:-4] + '.py')
+
+
+def sync(device: Device, paths: List[str], chunk_size: int) -> None:
+    """Upload the files that differ from those on the device."""
+    board = device.board
+    remote_paths = {path: to_remote_path(path) for path in paths}
+
+    board.enter_raw_repl()
+    try:
+        remote = remote_hashes(board, list(remote_paths.values()))
+        changed = [path for path in paths
+                   if local_hash(path, chunk_size) != remote[remote_paths[path]]]
+        device.log('{} of {} files changed'.format(len(changed), len(paths)))
+        if not changed:
+            return
+
+        created_cache = set()
+        for path in device.progress('Uploading files', changed):
+            remote_path = remote_paths[path]
+            if verbose:
+                device.log('\n{} -> {}'.format(os.path.abspath(path), remote_path))
+            remote_dir = os.path.dirname(remote_path)
+            if remote_dir:
+                make_remote_dirs(board, remote_dir, created_cache)
+            put_streaming(board, path, remote_path, chunk_size)
+            if remote_path.endswith('.mpy'):
+                board.exec_(REMOVE_SCRIPT.format(path=remote_path[:-4] + '.py'))
+    finally:
+        board.exit_raw_repl()
+
+
+# prints a dict of the SHA-256 of each path, or None for paths that don't exist
+HASH_SCRIPT = """
+import hashlib, binascii
+def h(p):
+    try:
+        d = hashlib.sha256()
+        with open(p, 'rb') as f:
+            while True:
+                b = f.read(512)
+                if not b:
+                    break
+                d.update(b)
+        return binascii.hexlify(d.digest()).decode()
+    except OSError:
+        return None
+print(repr({{p: h(p) for p in {paths!r}}}))
+"""
+
+MKDIR_SCRIPT = """
+import os
+try:
+    os.mkdir({path!r})
+except OSError:
+    pass
+"""
+
+REMOVE_SCRIPT = """
+import os
+try:
+    os.remove({path!r})
+except OSError:
+    pass
+"""
+
 
-    print('Soft reboot', file=sys.stderr, flush=True)
-    soft_reset(board)
+def to_remote_path(path: str) -> str:
+    """Convert a local relative path to the path on the device."""
+    return os.path.normpath(path).replace(os.path.sep, '/')
+
+
+def local_hash(path: str, chunk_size: int) -> str:
+    """Return the SHA-256 of a local file, as hex."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fd:
+        for chunk in iter(lambda: fd.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def remote_hashes(board: Pyboard, paths: List[str]) -> Dict[str, Optional[str]]:
+    """Return the SHA-256 of each file on the device, as hex, or None for files
+    that don't exist. The board must be in the raw REPL."""
+    output = board.exec_(HASH_SCRIPT.format(paths=paths))
+    return ast.literal_eval(output.decode().strip())
+
+
+def make_remote_dirs(board: Pyboard, path: str, created_cache: Set[str]) -> None:
+    """Make all the directories in a device path. The board must be in the raw
+    REPL."""
+    parent = os.path.dirname(path)
+    if parent and parent not in created_cache:
+        make_remote_dirs(board, parent, created_cache)
+    if path not in created_cache:
+        board.exec_(MKDIR_SCRIPT.format(path=path))
+        created_cache.add(path)
+
+
+def put_streaming(board: Pyboard, local_path: str, remote_path: str,
+                  chunk_size: int) -> None:
+    """Write a local file to the device a chunk at a time, without reading the
+    whole file into memory on either side. The board must be in the raw REPL."""
+    board.exec_('f = open({!r}, "wb")'.format(remote_path))
+    try:
+        with open(local_path, 'rb') as fd:
+            for chunk in iter(lambda: fd.read(chunk_size), b''):
+                board.exec_('f.write({!r})'.format(chunk))
+    finally:
+        board.exec_('f.close()')
 
 
 def make_dirs(files: Files, path: str,
@@ -100,6 +233,14 @@ def make_dirs(files: Files, path: str,
         created_cache.add(path)
 
 
+def remove_source(device: Device, path: str) -> None:
+    """Remove the source module a compiled module replaces, if it exists."""
+    with suppress(RuntimeError):
+        device.files.rm(path)
+        if verbose:
+            device.log('\nremoved {}'.format(path))
+
+
 def soft_reset(board: Pyboard) -> None:
     """Perform soft-reset of the ESP8266 board."""
     board.serial.write(b'\x03\x04')
@@ -121,19 +262,5 @@ def wait_for_board() -> None:
     time.sleep(0.5)
 
 
-def progress(msg: str, xs: Sequence[T]) -> Iterable[T]:
-    """Show progress while iterating over a sequence."""
-    size = len(xs)
-    sys.stderr.write('\r{}: 0% (0/{})'.format(msg, size))
-    sys.stderr.flush()
-    for i, x in enumerate(xs, 1):
-        yield x
-        s = '{0}: {1}% ({2}/{3})'.format(msg, int(i * 100 / size), i, size)
-        sys.stderr.write('\r' + s)
-        sys.stderr.flush()
-    sys.stderr.write('\n')
-    sys.stderr.flush()
-
-
 if __name__ == '__main__':
     main(sys.argv[1:])
@@ -1,25 +1,65 @@
+"""Convert PNG images to MicroPython MONO_HLSB framebuffers.
+
+Given one PNG, prints MicroPython code creating a FrameBuffer for it.
+
+With --bundle, converts every PNG in a directory and writes them all to one
+binary bundle that images.py loads with a single read. Each image is named for
+its file, without the icons8- prefix, with its size appended, e.g.
+icons8-rainfall-16.png is rain-16. Identical bitmaps are only stored once.
+
+The bundle starts with a header: the magic bytes IMGB, then the number of images
+as one byte. Each image then has an index entry: the length of its name as one
+byte, the name, its width and height as one byte each, and the offset of its
+bitmap in the data as a little-endian uint16. The bitmaps follow the index.
+
+Usage:
+    png_to_framebuffer PNG
+    png_to_framebuffer --bundle [DIR] [options]
+
+Options:
+    -o --output=PATH        The bundle to write [default: images.bin].
+    -v --verbose            Verbose output.
+"""
+
+import glob
+import hashlib
+import os
+import struct
 import sys
+
+from docopt import docopt
 from PIL import Image
 
+BUNDLE_MAGIC = b'IMGB'
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMG_DIR = os.path.join(ROOT_DIR, 'resources', 'img')
+
+# names used on the device for images whose files are named differently
+NAME_ALIASES = {
+    'cloud-lightning': 'lightning',
+    'rainfall': 'rain',
+    'snowflake': 'snow',
+}
+
+# pixels brighter than this are white (0), else black (1)
+THRESHOLD = 128
+
+# lookup tables, so whole images are converted at once rather than a pixel or byte at a time
+THRESHOLD_TABLE = [0 if x > THRESHOLD else 1 for x in range(256)]
+INVERT_TABLE = bytes(~x & 0xFF for x in range(256))
+
 
 def convert_image_to_mono_bytes(image):
     # Convert the image to black and white (1-bit pixels) using a threshold
-    threshold = 128  # [0, 255], where pixels brighter than this are white (0), else black (1)
     # Using 'L' mode for grayscale ensures that alpha is not considered in the conversion
-    bw_image = image.convert('L').point(lambda x: 0 if x > threshold else 1, '1')
-
-    # Convert the image to a byte array
-    # '1' format for the image means it's stored as 1-bit pixels, exactly what we need for framebuf
-    byte_array = bytearray(bw_image.tobytes())
+    bw_image = image.convert('L').point(THRESHOLD_TABLE, '1')
 
+    # '1' format for the image means it's stored as 1-bit pixels, exactly what we need for framebuf.
     # Since we're using MONO_HLSB, we need to invert the bits
     # because in the PIL library, 0 is black and 1 is white, which is the opposite in framebuf
-    inverted_byte_array = bytearray(len(byte_array))
-    for i, byte in enumerate(byte_array):
-        # Invert bits
-        inverted_byte_array[i] = ~byte & 0xFF
-
-    return inverted_byte_array
+    return bytearray(bw_image.tobytes().translate(INVERT_TABLE))
 
 
 def generate_micropython_code(byte_array, width, height):
@@ -31,7 +71,8 @@ def generate_micropython_code(byte_array, width, height):
     return fb_code
 
 
-def process_image(image_path):
+def load_image(image_path):
+    """Returns the image as MONO_HLSB bytes, with its width and height."""
     # Open the image
     with Image.open(image_path) as img:
         # Check if the image has an alpha channel
@@ -45,24 +86,83 @@ def process_image(image_path):
             img = background.convert('1')
 
         # Convert to monochrome (1-bit) byte array suitable for FrameBuffer
-        byte_array = convert_image_to_mono_bytes(img)
+        return convert_image_to_mono_bytes(img), img.width, img.height
 
-    # Generate MicroPython code
-    return generate_micropython_code(byte_array, img.width, img.height)
 
+def process_image(image_path):
+    byte_array, width, height = load_image(image_path)
 
-def main():
-    if len(sys.argv) != 2:
-        print("Usage: python png_to_framebuffer.py <path_to_png_file>")
+    # Generate MicroPython code
+    return generate_micropython_code(byte_array, width, height)
+
+
+def image_name(image_path, width):
+    """Returns the name of the image on the device, e.g. rain-16 for icons8-rainfall-16.png."""
+    name = os.path.splitext(os.path.basename(image_path))[0]
+    if name.startswith('icons8-'):
+        name = name[len('icons8-'):]
+    suffix = '-{}'.format(width)
+    if name.endswith(suffix):
+        name = name[:-len(suffix)]
+    return NAME_ALIASES.get(name, name) + suffix
+
+
+def build_bundle(image_paths, verbose=False):
+    """Converts the images and returns the bundle bytes."""
+    index = []
+    data = bytearray()
+    offsets = {}
+    for image_path in sorted(image_paths):
+        byte_array, width, height = load_image(image_path)
+        name = image_name(image_path, width)
+
+        # identical bitmaps share their data
+        digest = hashlib.sha256(byte_array).digest()
+        offset = offsets.get(digest)
+        if offset is None:
+            offset = offsets[digest] = len(data)
+            data += byte_array
+        elif verbose:
+            print('{} is a duplicate'.format(name), file=sys.stderr)
+
+        index.append((name, width, height, offset))
+        if verbose:
+            print('{} -> {} ({}x{}, offset {})'.format(os.path.basename(image_path), name, width, height, offset),
+                  file=sys.stderr)
+
+    bundle = bytearray(BUNDLE_MAGIC)
+    bundle.append(len(index))
+    for name, width, height, offset in index:
+        encoded = name.encode()
+        bundle.append(len(encoded))
+        bundle += encoded
+        bundle += struct.pack('<BBH', width, height, offset)
+    return bytes(bundle + data)
+
+
+def main(args):
+    opts = docopt(__doc__, argv=args)
+
+    if not opts['--bundle']:
+        try:
+            code = process_image(opts['PNG'])
+            print(code)
+        except Exception as e:
+            print(f"Error: {e}")
+        return
+
+    img_dir = opts['DIR'] or IMG_DIR
+    image_paths = glob.glob(os.path.join(img_dir, '*.png'))
+    if not image_paths:
+        print('No images in {}'.format(img_dir), file=sys.stderr)
         sys.exit(1)
 
-    png_file = sys.argv[1]
-    try:
-        code = process_image(png_file)
-        print(code)
-    except Exception as e:
-        print(f"Error: {e}")
+    bundle = build_bundle(image_paths, opts['--verbose'])
+    with open(opts['--output'], 'wb') as f:
+        f.write(bundle)
+    print('Wrote {} images to {} ({} bytes)'.format(len(image_paths), opts['--output'], len(bundle)),
+          file=sys.stderr)
 
 
 if __name__ == "__main__":
-    main()
+    main(sys.argv[1:])
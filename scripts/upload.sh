@@ -6,7 +6,7 @@ ROOT_DIR=$(git rev-parse --show-toplevel)
 
 if [[ $# -eq 0 ]]; then
   FILES_TO_UPLOAD=$(ls *.py)
-  FILES_TO_UPLOAD+=" config.txt"
+  FILES_TO_UPLOAD+=" images.bin config.txt"
 else
   FILES_TO_UPLOAD="$@"
 fi
@@ -11,6 +11,18 @@ class Config:
     openweathermap_key: str
     refresh_mins: int
     cache_mins: int
+    full_refresh_every: int = 10
+    sleep_mode: str = 'idle'
+    wifi_timeout_secs: int = 20
+    static_ip: str = None
+    netmask: str = '255.255.255.0'
+    gateway: str = None
+    dns: str = None
+    reuse_lease: bool = False
+    profile: bool = False
+    log_level: str = 'warning'
+    weather_gateway: str = None
+    gateway_frames: bool = False
 
 
 def format_date(dt: int) -> str:
@@ -84,6 +96,30 @@ def read_config() -> Config:
                 config.refresh_mins = int(line[13:].strip())
             elif line.startswith('cache_mins='):
                 config.cache_mins = int(line[11:].strip())
+            elif line.startswith('full_refresh_every='):
+                config.full_refresh_every = int(line[19:].strip())
+            elif line.startswith('sleep_mode='):
+                config.sleep_mode = line[11:].strip()
+            elif line.startswith('wifi_timeout_secs='):
+                config.wifi_timeout_secs = int(line[18:].strip())
+            elif line.startswith('static_ip='):
+                config.static_ip = line[10:].strip()
+            elif line.startswith('netmask='):
+                config.netmask = line[8:].strip()
+            elif line.startswith('gateway='):
+                config.gateway = line[8:].strip()
+            elif line.startswith('dns='):
+                config.dns = line[4:].strip()
+            elif line.startswith('reuse_lease='):
+                config.reuse_lease = line[12:].strip() == 'true'
+            elif line.startswith('profile='):
+                config.profile = line[8:].strip() == 'true'
+            elif line.startswith('log_level='):
+                config.log_level = line[10:].strip()
+            elif line.startswith('weather_gateway='):
+                config.weather_gateway = line[16:].strip()
+            elif line.startswith('gateway_frames='):
+                config.gateway_frames = line[15:].strip() == 'true'
 
     return config
 
@@ -129,6 +165,7 @@ def truncate_lines(lines: list[str], max_lines: int) -> list[str]:
     else:
         lines = lines[0:max_lines]
         lines[-1] = lines[-1][0:-3].strip() + "..."
+        return lines
 
 
 def dir_exists(filename):
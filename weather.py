@@ -1,9 +1,14 @@
 import urequests as requests
 
-import json
 import os
+import struct
 import utime
+from micropython import const
 
+import jsonstream
+import log
+import profiler
+from net import timings as network_timings
 from render import DisplayController
 from utils import wrap_text, sentence_join, ensure_suffix, dir_exists, file_exists
 
@@ -52,7 +57,55 @@ class Weather:
         return cls(data['dt'], temp, data['titles'], data['description'], data['day_summary'])
 
 
+# the OpenWeatherMap API
+API_BASE = 'https://api.openweathermap.org'
+
 CACHE_DIR = 'cache'
+CACHE_FILE = f'{CACHE_DIR}/weather.bin'
+
+# HTTP validators from the last response: ETag, then Last-Modified, one per line
+VALIDATORS_FILE = f'{CACHE_DIR}/validators.txt'
+
+# cache file header: magic, then the device time the weather was stored at
+CACHE_MAGIC = b'PWC1'
+CACHE_HEADER_FORMAT = '<4sI'
+CACHE_HEADER_SIZE = struct.calcsize(CACHE_HEADER_FORMAT)
+
+# start of each weather record: dt, then main/min/max temperature; the strings follow it, length-prefixed
+WEATHER_RECORD_FORMAT = '<Ifff'
+WEATHER_RECORD_SIZE = struct.calcsize(WEATHER_RECORD_FORMAT)
+
+# set to 1 and recompile to log the parsed conditions and cache checks
+_DEBUG = const(0)
+
+# weather kept in memory between refreshes, by timeframe, as (stored_at, weather)
+_memory_cache = {}
+
+WEATHER_CONDITIONS_SPEC = [{'main': True, 'description': True}]
+
+# the parts of the One Call API response that parse_weather() reads; the API can't select fields or limit the number
+# of daily forecasts, so the response is closed once today's forecast has been read, and the rest is never downloaded
+WEATHER_RESPONSE_SPEC = {
+    'current': {
+        'dt': True,
+        'temp': True,
+        'weather': WEATHER_CONDITIONS_SPEC,
+    },
+    'daily': {
+        0: jsonstream.StopAfter({
+            'temp': {'day': True, 'min': True, 'max': True},
+            'weather': WEATHER_CONDITIONS_SPEC,
+            'summary': True,
+        }),
+    },
+}
+
+
+class WeatherUnchanged(Exception):
+    """
+    Raised while parsing a response if it holds the same weather as the cache.
+    """
+    pass
 
 
 def get_img_for_title(title: str) -> str:
@@ -64,8 +117,10 @@ def get_img_for_title(title: str) -> str:
     # convert title to image per https://openweathermap.org/weather-conditions#Weather-Condition-Codes-2
     if title == 'Clouds':
         img_path = 'cloud'
-    elif title == 'Mist' or title == 'Smoke' or title == 'Haze' or title == 'Dust' or title == 'Fog' or title == 'Sand' or title == 'Dust' or title == 'Ash' or title == 'Squall' or title == 'Tornado':
+    elif title == 'Mist' or title == 'Smoke' or title == 'Haze' or title == 'Dust' or title == 'Fog' or title == 'Sand' or title == 'Dust' or title == 'Ash':
         img_path = 'fog'
+    elif title == 'Squall' or title == 'Tornado':
+        img_path = 'wind'
     elif title == 'Rain' or title == 'Drizzle':
         img_path = 'rain'
     elif title == 'Thunderstorm':
@@ -75,31 +130,177 @@ def get_img_for_title(title: str) -> str:
     elif title == 'Clear':
         img_path = 'sun'
     else:
-        print(f"unknown weather.title: {title}")
+        log.warning("unknown weather.title: %s", title)
         img_path = None
 
     return img_path
 
 
-def fetch_weather(lat: str, lon: str, openweathermap_key: str) -> tuple[Weather, Weather]:
+def fetch_weather(lat: str, lon: str, openweathermap_key: str, last_dt: int = 0, api_base: str = API_BASE,
+                  remember_validators: bool = True) -> tuple[Weather, Weather]:
     """
     Fetches the current weather from OpenWeatherMap and returns a tuple
-    of Weather objects [current, daily]
+    of Weather objects [current, daily], or None if the weather hasn't changed since the cached weather.
+
+    The request is conditional if the last response had an ETag or Last-Modified header. Otherwise, the response is
+    abandoned as soon as its current.dt is found to match last_dt, before the rest of it is downloaded.
     :param lat: the latitude
     :param lon: the longitude
     :param openweathermap_key: the OpenWeatherMap API key
+    :param last_dt: the dt of the cached weather, or 0 if there is none
+    :param api_base: the base URL of the API
+    :param remember_validators: whether to save the response's validators, for a conditional request next time
     :return: the Weather objects
     """
     # reduce the amount of data returned by excluding minutely, hourly, and alerts
     exclude = "minutely,hourly,alerts"
 
-    url = f"https://api.openweathermap.org/data/3.0/onecall?lat={lat}&lon={lon}&appid={openweathermap_key}&exclude={exclude}"
-    print(f"querying {url}")
-    r = requests.get(url)
-    resp: dict = r.json()
-    # print(resp)
-    r.close()
+    url = f"{api_base}/data/3.0/onecall?lat={lat}&lon={lon}&appid={openweathermap_key}&exclude={exclude}"
+    # the URL holds the API key, so only the location is logged
+    log.info("querying weather for %s,%s", lat, lon)
+
+    headers = {}
+    etag, last_modified = load_validators() if last_dt else (None, None)
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+
+    start = utime.ticks_ms()
+    with profiler.span('http'):
+        r = requests.get(url, headers=headers)
+    network_timings['first_byte'] = utime.ticks_diff(utime.ticks_ms(), start)
+    log.info("response headers received in %d ms", network_timings['first_byte'])
+
+    def check_dt(dt: int) -> int:
+        if dt == last_dt:
+            raise WeatherUnchanged()
+        return dt
+
+    spec = WEATHER_RESPONSE_SPEC
+    if last_dt:
+        spec = {'current': dict(WEATHER_RESPONSE_SPEC['current'], dt=check_dt), 'daily': WEATHER_RESPONSE_SPEC['daily']}
+
+    try:
+        if r.status_code == 304:
+            log.info("weather not modified")
+            return None
+
+        # parse the response as it arrives, rather than buffering the whole body
+        with profiler.span('parse'):
+            resp: dict = jsonstream.parse(r.raw, spec)
+    except WeatherUnchanged:
+        log.info("weather unchanged since dt %d", last_dt)
+        return None
+    finally:
+        # closing the connection discards any of the response that wasn't read
+        r.close()
+
+    if remember_validators:
+        save_validators(header_value(r.headers, 'ETag'), header_value(r.headers, 'Last-Modified'))
+    return parse_weather(resp)
+
+
+def fetch_weather_from_gateway(gateway_url: str, lat: str, lon: str, last_dt: int = 0) -> tuple[Weather, Weather]:
+    """
+    Fetches the weather from a fleet gateway (see host/gateway.py) rather than from OpenWeatherMap, and returns a tuple
+    of Weather objects [current, daily], or None if the weather hasn't changed since the cached weather.
+
+    The gateway sends the weather as the binary records used by the cache file, so there's nothing to parse, and tags
+    it with its dt, so the request is conditional on the cached weather.
+    :param gateway_url: the base URL of the gateway
+    :param lat: the latitude
+    :param lon: the longitude
+    :param last_dt: the dt of the cached weather, or 0 if there is none
+    :return: the Weather objects
+    """
+    url = f"{gateway_url}/weather?lat={lat}&lon={lon}"
+    log.info("querying gateway for %s,%s", lat, lon)
+
+    headers = {}
+    if last_dt:
+        headers['If-None-Match'] = f'"{last_dt}"'
+
+    start = utime.ticks_ms()
+    with profiler.span('http'):
+        r = requests.get(url, headers=headers)
+    network_timings['first_byte'] = utime.ticks_diff(utime.ticks_ms(), start)
+
+    try:
+        if r.status_code == 304:
+            log.info("weather not modified")
+            return None
+        if r.status_code != 200:
+            raise OSError(f"gateway returned status {r.status_code}")
+        data = r.content
+    finally:
+        r.close()
+
+    current, offset = unpack_weather(data, 0)
+    daily, _ = unpack_weather(data, offset)
+    return current, daily
+
+
+def pack_weather_pair(current: Weather, daily: Weather) -> bytes:
+    """
+    Returns the binary records for the current and daily weather, as sent by the gateway.
+    :param current: the current weather
+    :param daily: the daily weather
+    """
+    out = bytearray()
+    pack_weather(out, current)
+    pack_weather(out, daily)
+    return bytes(out)
+
+
+def header_value(headers: dict, name: str) -> str:
+    """
+    Returns the value of the given response header, ignoring case, or None if it is not present.
+    :param headers: the response headers
+    :param name: the header name
+    """
+    name = name.lower()
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def load_validators() -> tuple[str, str]:
+    """
+    Returns the ETag and Last-Modified values saved from the last response; either may be None.
+    """
+    if not file_exists(VALIDATORS_FILE):
+        return None, None
+
+    with open(VALIDATORS_FILE) as f:
+        lines = f.read().split('\n')
+    if len(lines) < 2:
+        return None, None
+    return lines[0] or None, lines[1] or None
+
+
+def save_validators(etag: str, last_modified: str):
+    """
+    Saves the ETag and Last-Modified values from a response, for a conditional request next time. The file is only
+    written if they have changed, to save a flash write.
+    :param etag: the ETag, or None
+    :param last_modified: the Last-Modified value, or None
+    """
+    if (etag or None, last_modified or None) == load_validators():
+        return
+
+    ensure_cache_dir()
+    with open(VALIDATORS_FILE, 'w') as f:
+        f.write(f"{etag or ''}\n{last_modified or ''}")
+
 
+def parse_weather(resp: dict) -> tuple[Weather, Weather]:
+    """
+    Parses a One Call API response and returns a tuple of Weather objects [current, daily]
+    :param resp: the decoded response
+    :return: the Weather objects
+    """
     current_conditions = resp['current']
     dt: int = current_conditions['dt']
 
@@ -118,7 +319,7 @@ def fetch_weather(lat: str, lon: str, openweathermap_key: str) -> tuple[Weather,
         daily = Weather(dt, daily_temp, daily_titles, daily_desc, day_summary)
 
     else:
-        print(f"no daily weather returned")
+        log.warning("no daily weather returned")
         daily = Weather(dt, Temperature(0, 0, 0), [], "", [])
 
     return current, daily
@@ -143,7 +344,8 @@ def summarise_conditions(weather_timeframe, conditions) -> tuple[Temperature, li
         temp = Temperature(single_temp, single_temp, single_temp)
 
     weathers = conditions['weather']
-    print(f"{len(weathers)} {weather_timeframe} weather(s): ", weathers)
+    if _DEBUG:
+        log.debug("%d %s weather(s): %s", len(weathers), weather_timeframe, weathers)
 
     summary: tuple[Temperature, list[str], str]
     if len(weathers) > 0:
@@ -157,10 +359,11 @@ def summarise_conditions(weather_timeframe, conditions) -> tuple[Temperature, li
         summary = temp, titles, sentence_join(descriptions)
 
     else:
-        print(f"no {weather_timeframe} weather returned")
+        log.warning("no %s weather returned", weather_timeframe)
         summary = temp, [], ""
 
-    print(f"{weather_timeframe}: {summary}")
+    if _DEBUG:
+        log.debug("%s: %s", weather_timeframe, summary)
     return summary
 
 
@@ -181,67 +384,209 @@ def ensure_cache_dir():
         os.mkdir(CACHE_DIR)
 
 
-def is_cache_valid(timeframe: str, cache_mins: int) -> bool:
+def is_fresh(stored_at: int, cache_mins: int) -> bool:
     """
-    Returns the timestamp of the most recent cached weather data, or 0 if no cache exists.
-    :param timeframe: the timeframe
+    Returns whether weather stored at the given time is younger than the cache expiry.
+    :param stored_at: the device time the weather was stored at
     :param cache_mins: the cache expiry in minutes
     """
-    ensure_cache_dir()
+    if cache_mins is None:
+        return True
+
+    age = utime.time() - stored_at
+    if _DEBUG:
+        log.debug("cache is %d seconds old", age)
 
+    # if age is negative, the device RTC is probably not set
+    return 0 <= age < (cache_mins * 60)
+
+
+def remember_weather(timeframe: str, weather: Weather, stored_at: int):
+    """
+    Keeps the given weather in memory, so later refreshes in the same session don't need to read the cache file.
+    :param timeframe: the timeframe
+    :param weather: the weather
+    :param stored_at: the device time the weather was stored at
+    """
+    _memory_cache[timeframe] = (stored_at, weather)
+
+
+def cache_stored_at() -> int:
+    """
+    Returns the device time the weather in memory was stored at, or 0 if there is none.
+    """
+    entry = _memory_cache.get('current')
+    return entry[0] if entry else 0
+
+
+def recall_weather(timeframe: str, cache_mins: int) -> Weather:
+    """
+    Returns the weather kept in memory for the given timeframe, or None if there is none or it has expired.
+    :param timeframe: the timeframe
+    :param cache_mins: the cache expiry in minutes, or None to ignore expiry
+    """
+    entry = _memory_cache.get(timeframe)
+    if entry is None or not is_fresh(entry[0], cache_mins):
+        return None
+    return entry[1]
+
+
+def is_cache_valid(cache_mins: int) -> bool:
+    """
+    Returns whether the cached weather exists and is younger than the cache expiry. Only the header of the cache file
+    is read.
+    :param cache_mins: the cache expiry in minutes, or None to ignore expiry
+    """
     is_valid: bool
-    if file_exists(f'{CACHE_DIR}/{timeframe}_timestamp'):
-        with open(f'{CACHE_DIR}/{timeframe}_timestamp', 'r') as f:
-            timestamp = int(f.read())
-            age = utime.time() - timestamp
-            print(f"cache for {timeframe} is {age} seconds old")
+    if file_exists(CACHE_FILE):
+        with open(CACHE_FILE, 'rb') as f:
+            header = f.read(CACHE_HEADER_SIZE)
 
-            # if age is negative, the device RTC is probably not set
-            is_valid = 0 <= age < (cache_mins * 60)
+        if len(header) == CACHE_HEADER_SIZE and header[0:4] == CACHE_MAGIC:
+            stored_at = struct.unpack_from(CACHE_HEADER_FORMAT, header)[1]
+            is_valid = is_fresh(stored_at, cache_mins)
+        else:
+            log.warning("cache file is not recognised")
+            is_valid = False
 
     else:
         is_valid = False
 
-    print(f"cache for {timeframe} is {'valid' if is_valid else 'invalid'} (expiry {cache_mins} mins)")
+    if _DEBUG:
+        log.debug("cache is %s (expiry %s mins)", 'valid' if is_valid else 'invalid', cache_mins)
     return is_valid
 
 
-def cache_weather(weather: Weather, timeframe: str):
+def _pack_str(out: bytearray, value: str, length_format: str):
+    encoded = value.encode('utf-8')
+    out.extend(struct.pack(length_format, len(encoded)))
+    out.extend(encoded)
+
+
+def _unpack_str(data: bytes, offset: int, length_format: str) -> tuple[str, int]:
+    length = struct.unpack_from(length_format, data, offset)[0]
+    offset += struct.calcsize(length_format)
+    return str(data[offset:offset + length], 'utf-8'), offset + length
+
+
+def pack_weather(out: bytearray, weather: Weather):
     """
-    Caches the given weather.
+    Appends the binary record for the given weather to the buffer.
+    :param out: the buffer
     :param weather: the weather
-    :param timeframe: the timeframe
+    """
+    out.extend(struct.pack(WEATHER_RECORD_FORMAT, weather.dt,
+                           weather.temp.main, weather.temp.temp_min, weather.temp.temp_max))
+    out.extend(struct.pack('<B', len(weather.titles)))
+    for title in weather.titles:
+        _pack_str(out, title, '<B')
+    _pack_str(out, weather.description, '<H')
+    out.extend(struct.pack('<B', len(weather.day_summary)))
+    for line in weather.day_summary:
+        _pack_str(out, line, '<B')
+
+
+def unpack_weather(data: bytes, offset: int) -> tuple[Weather, int]:
+    """
+    Reads the binary record for a weather from the buffer.
+    :param data: the buffer
+    :param offset: the offset of the record
+    :return: the weather, and the offset following the record
+    """
+    dt, temp_main, temp_min, temp_max = struct.unpack_from(WEATHER_RECORD_FORMAT, data, offset)
+    offset += WEATHER_RECORD_SIZE
+
+    titles = []
+    count = data[offset]
+    offset += 1
+    for _ in range(count):
+        title, offset = _unpack_str(data, offset, '<B')
+        titles.append(title)
+
+    description, offset = _unpack_str(data, offset, '<H')
+
+    day_summary = []
+    count = data[offset]
+    offset += 1
+    for _ in range(count):
+        line, offset = _unpack_str(data, offset, '<B')
+        day_summary.append(line)
+
+    return Weather(dt, Temperature(temp_main, temp_min, temp_max), titles, description, day_summary), offset
+
+
+def cache_weather(current: Weather, daily: Weather):
+    """
+    Caches the given weather in a single file. The file is written alongside the existing cache then renamed over it,
+    so an interrupted write never leaves a partial cache.
+    :param current: the current weather
+    :param daily: the daily weather
     """
     ensure_cache_dir()
-    print(f"caching weather for {timeframe}")
+    log.info("caching weather")
+
+    # note, the stored timestamp is not necessarily the same as the weather.dt timestamp
+    # as it depends on the device RTC
+    stored_at = utime.time()
+    remember_weather('current', current, stored_at)
+    remember_weather('daily', daily, stored_at)
+
+    out = bytearray(struct.pack(CACHE_HEADER_FORMAT, CACHE_MAGIC, stored_at))
+    pack_weather(out, current)
+    pack_weather(out, daily)
 
-    with open(f'{CACHE_DIR}/{timeframe}.json', 'w') as f:
-        weather_json = json.dumps(weather.to_dict())
-        f.write(weather_json)
+    tmp_file = CACHE_FILE + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        f.write(out)
 
-    with open(f'{CACHE_DIR}/{timeframe}_timestamp', 'w') as f:
-        # write the current timestamp
-        # note, this is not necessarily the same as the weather.dt timestamp
-        # is it depends on the device RTC
-        f.write(str(utime.time()))
+    try:
+        os.rename(tmp_file, CACHE_FILE)
+    except OSError:
+        # some filesystems won't rename over an existing file
+        os.remove(CACHE_FILE)
+        os.rename(tmp_file, CACHE_FILE)
 
 
-def load_cached_weather(timeframe: str, cache_mins: int) -> Weather:
+def renew_cached_weather(current: Weather, daily: Weather):
     """
-    Returns the cached weather, or None if no cache exists.
-    :param timeframe: the timeframe
-    :param cache_mins: the cache expiry in minutes
+    Restarts the expiry of the cached weather after the remote reported no change. Only the copy in memory is renewed,
+    to save a flash write.
+    :param current: the current weather
+    :param daily: the daily weather
     """
-    if not is_cache_valid(timeframe, cache_mins):
+    stored_at = utime.time()
+    remember_weather('current', current, stored_at)
+    remember_weather('daily', daily, stored_at)
+
+
+def load_cached_weather(cache_mins: int) -> tuple[Weather, Weather]:
+    """
+    Returns the cached current and daily weather, or None if no valid cache exists. Weather kept in memory is used
+    first; the cache file is only read after a reset.
+    :param cache_mins: the cache expiry in minutes, or None to ignore expiry
+    """
+    current = recall_weather('current', cache_mins)
+    daily = recall_weather('daily', cache_mins)
+    if current and daily:
+        log.info("loaded cached weather from memory")
+        return current, daily
+
+    if not is_cache_valid(cache_mins):
         return None
 
-    ensure_cache_dir()
-    if file_exists(f'{CACHE_DIR}/{timeframe}.json'):
-        with open(f'{CACHE_DIR}/{timeframe}.json', 'r') as f:
-            weather_json = f.read()
-            print(f"loaded cached weather for {timeframe}", weather_json)
-            weather_dict = json.loads(weather_json)
-            return Weather.from_dict(weather_dict)
-    else:
-        print(f"cache for {timeframe} does not exist")
+    with open(CACHE_FILE, 'rb') as f:
+        data = f.read()
+
+    try:
+        current, offset = unpack_weather(data, CACHE_HEADER_SIZE)
+        daily, _ = unpack_weather(data, offset)
+    except (ValueError, IndexError) as e:
+        log.warning("cache file is corrupt: %s", e)
         return None
+
+    stored_at = struct.unpack_from(CACHE_HEADER_FORMAT, data)[1]
+    remember_weather('current', current, stored_at)
+    remember_weather('daily', daily, stored_at)
+
+    log.info("loaded cached weather from file")
+    return current, daily